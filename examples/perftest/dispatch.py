@@ -0,0 +1,69 @@
+"""Measures how fast the hub dispatches socket events to greenlets
+
+Each connection is a UDP socket with a greenlet waiting for a datagram on
+it. Every round a datagram is sent to each of them, so each poll returns
+lots of events which are dispatched to lots of waiters at once. UDP is
+used to have one file descriptor per connection.
+"""
+import sys
+import time
+import socket
+from functools import partial
+
+from zorro import Hub, gethub, Condition
+
+
+def reader(sock, rounds, received, cond):
+    hub = gethub()
+    for i in range(rounds):
+        hub.do_read(sock)
+        sock.recv(16)
+        received[0] -= 1
+        if not received[0]:
+            cond.notify()
+
+
+def driver(num, rounds, result):
+    hub = gethub()
+    socks = []
+    received = [num]
+    cond = Condition()
+    for i in range(num):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(0)
+        socks.append(sock)
+        hub.do_spawn(partial(reader, sock, rounds, received, cond))
+    addrs = [s.getsockname() for s in socks]
+    out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    hub.do_sleep(0.01)  # let readers start waiting
+    polls = hub.counters['polls']
+    duration = 0
+    for i in range(rounds):
+        for addr in addrs:
+            out.sendto(b'x', addr)
+        # only dispatching is measured, not sending
+        start = time.time()
+        while received[0]:
+            cond.wait()
+        duration += time.time() - start
+        received[0] = num
+    result.append((duration, hub.counters['polls'] - polls))
+    for s in socks:
+        s.close()
+    out.close()
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    result = []
+    hub = Hub()
+    hub.run(partial(driver, num, rounds, result))
+    tm, polls = result[0]
+    print("{} connections, {} rounds: {:.3f}s, {:.0f} events/s, {} polls"
+        .format(num, rounds, tm, num*rounds/tm, polls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Measures HTTPClient against HTTPPool on a mix of slow and fast requests
+
+A keep-alive HTTP server runs in threads of this process. Every tenth
+request takes ``delay`` seconds, so with a single pipelined connection
+fast requests wait for the slow ones queued before them.
+
+Usage: http_pool.py [greenlets] [requests] [delay] [pool sizes...]
+"""
+import sys
+import time
+import threading
+import http.server
+import socketserver
+from functools import partial
+
+from zorro import Hub, Future, http as zhttp
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0.01
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'OK')
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def bench(make_request, greenlets, requests, result):
+    def worker():
+        for i in range(requests):
+            make_request('/slow' if i % 10 == 0 else '/')
+    start = time.time()
+    futures = [Future(worker) for i in range(greenlets)]
+    for f in futures:
+        f.get()
+    result.append(time.time() - start)
+
+
+def client(port, greenlets, requests, result):
+    cli = zhttp.HTTPClient('localhost', port)
+    bench(cli.request, greenlets, requests, result)
+
+
+def pool(port, size, greenlets, requests, result):
+    pool = zhttp.HTTPPool(max_connections=size)
+    base = 'http://localhost:{}'.format(port)
+    bench(lambda uri: pool.request(base + uri), greenlets, requests, result)
+    pool.close()
+
+
+def main():
+    greenlets = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    Handler.delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+    sizes = [int(a) for a in sys.argv[4:]] or [1, 4, 16]
+    srv = Server(('localhost', 0), Handler)
+    port = srv.server_address[1]
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    total = greenlets * requests
+    result = []
+    Hub().run(partial(client, port, greenlets, requests, result))
+    print("HTTPClient: {:.3f}s, {:.0f} requests/s".format(result[0],
+        total/result[0]))
+    for size in sizes:
+        result = []
+        Hub().run(partial(pool, port, size, greenlets, requests, result))
+        print("HTTPPool max_connections {}: {:.3f}s, {:.0f} requests/s"
+            .format(size, result[0], total/result[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measures INCR from lots of greenlets with and without batching
+
+Every greenlet does a single INCR, all of them at once, so without
+batching each command is a separate request of the channel. The server is
+a stand-in, which runs in a thread and answers ``INCR`` with a counter,
+unless the port of a real redis is passed.
+
+Usage: redis_batch.py [greenlets] [rounds] [port]
+"""
+import sys
+import time
+import socket
+import threading
+from functools import partial
+
+from zorro import Hub, Future, redis
+
+
+def stand_in(sock):
+    counter = 0
+    buf = b''
+    pos = 0
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        buf = buf[pos:] + data
+        pos = 0
+        out = []
+        while True:
+            # commands are arrays of bulk strings, like *2 $4 INCR $3 key
+            end = buf.find(b'\r\n', pos)
+            if end < 0:
+                break
+            num = int(buf[pos+1:end])
+            cur = end + 2
+            args = []
+            for i in range(num):
+                end = buf.find(b'\r\n', cur)
+                if end < 0:
+                    break
+                ln = int(buf[cur+1:end])
+                if len(buf) < end + 4 + ln:
+                    break
+                args.append(buf[end+2:end+2+ln])
+                cur = end + 4 + ln
+            if len(args) < num:
+                break
+            pos = cur
+            if args[0] == b'INCR':
+                counter += 1
+                out.append(b':' + str(counter).encode('ascii') + b'\r\n')
+            else:
+                out.append(b'+OK\r\n')
+        sock.sendall(b''.join(out))
+
+
+def serve(listener):
+    while True:
+        sock, addr = listener.accept()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=stand_in, args=(sock,), daemon=True).start()
+
+
+def bench(port, batch_size, greenlets, rounds, result):
+    r = redis.Redis(port=port, db=13, batch_size=batch_size)
+    r.execute('DEL', 'test:batch')
+    start = time.time()
+    for i in range(rounds):
+        futures = [Future(partial(r.execute, 'INCR', 'test:batch'))
+                   for i in range(greenlets)]
+        for f in futures:
+            f.get()
+    result.append(time.time() - start)
+    r.execute('DEL', 'test:batch')
+
+
+def main():
+    greenlets = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    if len(sys.argv) > 3:
+        port = int(sys.argv[3])
+    else:
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(10)
+        port = listener.getsockname()[1]
+        threading.Thread(target=serve, args=(listener,), daemon=True).start()
+    for batch_size in (None, 100, 1000, 10000):
+        result = []
+        Hub().run(partial(bench, port, batch_size, greenlets, rounds, result))
+        print("batch_size {}: {:.3f}s, {:.0f} commands/s".format(batch_size,
+            result[0], greenlets*rounds/result[0]))
+
+
+if __name__ == '__main__':
+    main()
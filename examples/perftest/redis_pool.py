@@ -0,0 +1,44 @@
+"""Measures redis throughput depending on the number of connections
+
+Lots of greenlets run GETs of a large value, so that replies of each
+connection are mostly waiting for each other. Needs redis on localhost.
+
+Usage: redis_pool.py [greenlets] [requests] [value size] [pool sizes...]
+"""
+import sys
+import time
+from functools import partial
+
+from zorro import Hub, Future, redis, sleep
+
+
+def bench(pool_size, greenlets, requests, size, result):
+    r = redis.Redis(pool_size=pool_size, db=13)
+    r.execute('SET', 'test:pool', b'x'*size)
+    sleep(0.1)  # let other connections come up
+    def worker():
+        for i in range(requests):
+            r.execute('GET', 'test:pool')
+    start = time.time()
+    futures = [Future(worker) for i in range(greenlets)]
+    for f in futures:
+        f.get()
+    result.append(time.time() - start)
+    r.execute('DEL', 'test:pool')
+
+
+def main():
+    greenlets = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    sizes = [int(a) for a in sys.argv[4:]] or [1, 2, 4, 8]
+    for pool_size in sizes:
+        result = []
+        Hub().run(partial(bench, pool_size, greenlets, requests, size,
+            result))
+        print("pool_size {}: {:.3f}s, {:.0f} requests/s".format(pool_size,
+            result[0], greenlets*requests/result[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Measures redis reply parser on synthetic replies, no server needed
+
+Replies are fed to the parser in chunks, like they are read from the
+socket. Best time of 5 runs is printed.
+"""
+import sys
+import time
+
+from zorro.redis import ReplyParser
+
+
+def bulk(value):
+    return b'$' + str(len(value)).encode('ascii') + b'\r\n' + value + b'\r\n'
+
+
+def streams(num):
+    yield 'array of {} bulk strings'.format(num), 1, (
+        b'*' + str(num).encode('ascii') + b'\r\n'
+        + b''.join(bulk(b'item:' + str(i).encode('ascii'))
+                   for i in range(num)))
+    yield '{} small replies'.format(num), num, b''.join(
+        (b'+OK\r\n', b':12345\r\n', bulk(b'value'), b'$-1\r\n')[i % 4]
+        for i in range(num))
+    yield '{} arrays of 10'.format(num//10), num//10, (
+        b'*10\r\n' + b''.join(bulk(b'field' + str(i).encode('ascii'))
+                              for i in range(10))) * (num//10)
+
+
+def bench(data, chunk):
+    replies = []
+    parse = ReplyParser().parse
+    buf = bytearray()
+    pos = 0
+    start = time.time()
+    for i in range(0, len(data), chunk):
+        if pos*2 > len(buf):
+            del buf[:pos]
+            pos = 0
+        buf += data[i:i+chunk]
+        pos = parse(buf, pos, replies.append)
+    return time.time() - start, len(replies)
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else 16384
+    for name, expected, data in streams(num):
+        tm, count = min(bench(data, chunk) for i in range(5))
+        assert count == expected, (count, expected)
+        print("{}: {:.3f}s, {:.1f} MB/s".format(name, tm,
+            len(data)/tm/1000000))
+
+
+if __name__ == '__main__':
+    main()
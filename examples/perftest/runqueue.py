@@ -0,0 +1,60 @@
+"""Queues and cancels lots of tasks in the hub's run queue
+
+Cancellation happens in random order, like greenlets being detached from
+the middle of the queue. The old deque-based queue is kept here for
+comparison.
+"""
+import sys
+import time
+import random
+from collections import deque
+
+from zorro.util import orderedset
+
+
+class dequeset(object):
+
+    def __init__(self):
+        self.deque = deque()
+
+    def add(self, *val):
+        self.deque.append(val)
+        def remover(*a):
+            self.deque.remove(val)
+        return remover
+
+    def first(self):
+        if self.deque:
+            return self.deque[0]
+        return None
+
+
+def bench(queue, num):
+    tasks = [object() for i in range(num)]
+    order = list(range(num))
+    random.shuffle(order)
+    start = time.time()
+    removers = {}
+    for task in tasks:
+        removers[task] = queue.add(task, 'timeout')
+    # detach half of the tasks from random places in the queue
+    for i in order[:num//2]:
+        removers.pop(tasks[i])()
+    # run the rest the way Hub.queue() does
+    while True:
+        tsk = queue.first()
+        if tsk is None:
+            break
+        removers.pop(tsk[0])()
+    return time.time() - start
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for name, cls in (('orderedset', orderedset), ('deque', dequeset)):
+        print("{:10s} {} tasks queued and cancelled: {:.3f}s".format(
+            name, num, bench(cls(), num)))
+
+
+if __name__ == '__main__':
+    main()
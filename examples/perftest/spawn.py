@@ -0,0 +1,53 @@
+"""Spawns lots of short tasks with and without recycling greenlets
+
+Each task yields to the hub once, like a request handler waiting for a
+reply, then finishes. Tasks are spawned in batches, the way
+``zmq.rep_listener`` spawns a task per message.
+"""
+import sys
+import time
+from functools import partial
+
+from greenlet import getcurrent
+
+from zorro import Hub, gethub
+
+
+def yield_once():
+    hub = gethub()
+    hub.queue_task(getcurrent())
+    hub._self.switch()
+
+
+def main_task(num, batch, switch, result):
+    hub = gethub()
+    spawn = hub.do_spawnswitch if switch else hub.do_spawn
+    start = time.time()
+    for i in range(num // batch):
+        for j in range(batch):
+            spawn(yield_once)
+        while len(hub._tasks) > 1:
+            yield_once()
+    result.append(time.time() - start)
+
+
+def bench(num, batch, switch, recycle):
+    result = []
+    hub = Hub(recycle_greenlets=recycle)
+    hub.run(partial(main_task, num, batch, switch, result))
+    return result[0]
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch = 100
+    for switch in (False, True):
+        for recycle in (0, batch):
+            tm = bench(num, batch, switch, recycle)
+            print("{:14s} recycle={:<4d} {} tasks: {:.3f}s, {:.0f} tasks/s"
+                .format('do_spawnswitch' if switch else 'do_spawn',
+                        recycle, num, tm, num/tm))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compares timer queues on armed-then-cancelled timeouts
+
+This is the usual pattern for request timeouts: each request arms a timer,
+and the reply cancels it long before it expires.
+"""
+import sys
+import time
+import random
+
+from zorro.util import priorityqueue, timerwheel
+
+
+def size(queue):
+    if isinstance(queue, priorityqueue):
+        return len(queue.heap)
+    return len(queue)
+
+
+def placement(queue):
+    """Where armed timers are, makes sure wheel levels are used at all"""
+    if isinstance(queue, priorityqueue):
+        return ''
+    assert not queue.overflow, "timers are past the wheel, wrong clock?"
+    return ", wheel levels {}".format(queue.counts)
+
+
+def bench(queue, num, inflight=50000):
+    now = time.monotonic()
+    timeouts = [1 + random.random()*30 for i in range(num)]
+    removers = []
+    start = time.time()
+    for i, tm in enumerate(timeouts):
+        removers.append(queue.add(now + tm, i))
+        if len(removers) >= inflight:
+            # reply to some request, its timer never fires
+            idx = random.randrange(len(removers))
+            removers[idx], removers[-1] = removers[-1], removers[idx]
+            removers.pop()()
+        if not i % 1000:
+            queue.min()  # once per loop iteration in the hub
+    where = placement(queue)
+    for rm in removers:
+        rm()
+    duration = time.time() - start
+    return duration, size(queue), where
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [100000, 300000, 1000000]
+    for num in sizes:
+        for name, queue in (('heap', priorityqueue()),
+                            ('wheel', timerwheel(0.001))):
+            duration, left, where = bench(queue, num)
+            print("{:6s} {:8d} timers: {:.3f}s ({:.0f} timers/s),"
+                  " {} entries still held{}".format(name, num, duration,
+                                                     num/duration, left,
+                                                     where))
+
+
+if __name__ == '__main__':
+    main()
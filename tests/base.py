@@ -36,12 +36,13 @@ def passive(zfun):
 
 class Test(unittest.TestCase):
     test_timeout = 1
+    hub_options = {}
 
     def setUp(self):
         import zorro
         from zorro import zmq
         self.z = zorro
-        self.hub = self.z.Hub()
+        self.hub = self.z.Hub(**self.hub_options)
         self.thread = threading.Thread(target=self.hub.run)
 
     def tearDown(self):
@@ -40,14 +40,46 @@ class TestCollectd(Test):
             s, a = sock.accept()
         with s:
             self.assertEqual(s.recv(4096),
-                b'PUTVAL test/test/test 1234:123.0:256.0')
+                b'PUTVAL test/test/test 1234:123.0:256.0\n')
             s.sendall(b'0 Success\n')
             self.assertEqual(s.recv(4096),
-                b'PUTNOTIF message="hello" severity=warning time=1234')
+                b'PUTNOTIF message="hello" severity=warning time=1234\n')
             s.sendall(b'0 Success\n')
-            self.assertEqual(s.recv(4096), b'FLUSH')
+            self.assertEqual(s.recv(4096), b'FLUSH\n')
             s.sendall(b'0 Success\n')
-            self.assertEqual(s.recv(4096), b'GETVAL test/test/test')
+            self.assertEqual(s.recv(4096), b'GETVAL test/test/test\n')
             s.sendall(b'2 Lines\nin=123\nout=234\n')
-            self.assertEqual(s.recv(4096), b'LISTVAL')
+            self.assertEqual(s.recv(4096), b'LISTVAL\n')
             s.sendall(b'2 Lines\n235 test/test/test\n657 test/test/test2\n')
+
+    def collectd_hub_stats(self):
+        self.z.sleep(0.1)
+        sock = self.z.collectd.Connection(unixsock=TEST_SOCKET)
+        sock.put_hub_stats(host='test', instance='1')
+
+    @interactive(collectd_hub_stats)
+    def test_hub_stats(self):
+        if os.access(TEST_SOCKET, os.F_OK):
+            os.unlink(TEST_SOCKET)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with sock:
+            sock.bind(TEST_SOCKET)
+            sock.listen(1024)
+            s, a = sock.accept()
+        lines = []
+        buf = b''
+        with s:
+            while len(lines) < len(self.hub.stats()) - 1:
+                buf += s.recv(4096)
+                *new, buf = buf.split(b'\n')
+                lines.extend(new)
+                s.sendall(b'0 Success\n'*len(new))
+        idents = {line.split()[1] for line in lines}
+        self.assertIn(b'test/zorro-1/derive-switches', idents)
+        self.assertIn(b'test/zorro-1/gauge-queue', idents)
+        self.assertIn(b'test/zorro-1/derive-run_time', idents)
+        self.assertIn(b'test/zorro-1/derive-ctl', idents)
+        self.assertNotIn(b'test/zorro-1/gauge-ctl_per_iteration', idents)
+        for line in lines:
+            if b'/derive-' in line:
+                self.assertRegex(line, rb':\d+$')
@@ -0,0 +1,162 @@
+import socket
+
+from .base import Test, passive
+
+
+class Channel(Test):
+
+    def setUp(self):
+        super().setUp()
+        import zorro.channel
+        from zorro.util import socket_pair
+        self.client, self.server = socket_pair()
+        self.buf = b''
+
+        class LineChannel(zorro.channel.PipelinedReqChannel):
+
+            def __init__(chan):
+                super().__init__()
+                chan._start()
+
+            def sender(chan):
+                wait_write = self.hub.do_write
+                while True:
+                    chan.wait_requests()
+                    wait_write(self.client)
+                    self.client.send(b''.join(chan.get_pending_requests()))
+
+            def receiver(chan):
+                buf = b''
+                while True:
+                    self.hub.do_read(self.client)
+                    data = self.client.recv(4096)
+                    if not data:
+                        raise EOFError()
+                    *lines, buf = (buf + data).split(b'\n')
+                    for line in lines:
+                        chan.produce(line)
+
+        self.LineChannel = LineChannel
+
+    def tearDown(self):
+        super().tearDown()
+        self.client.close()
+        self.server.close()
+
+    def reply(self, num):
+        while self.buf.count(b'\n') < num:
+            self.hub.do_read(self.server)
+            self.buf += self.server.recv(4096)
+        lines = self.buf.split(b'\n')
+        self.buf = b'\n'.join(lines[num:])
+        self.server.send(b''.join(line + b'\n' for line in lines[:num]))
+
+    @passive
+    def test_block(self):
+        chan = self.LineChannel()
+        chan.max_requests = 4
+        futures = []
+        def requester():
+            for i in range(10):
+                futures.append(chan.request(b'x\n'))
+        self.hub.do_spawn(requester)
+        self.z.sleep(0.01)
+        self.assertEqual(len(futures), 4)
+        self.assertEqual(chan.depth(),
+            {'requests': 4, 'bytes': 0, 'throttled': True})
+        self.reply(1)
+        self.z.sleep(0.01)
+        # one reply is not enough to get below low water mark
+        self.assertEqual(len(futures), 4)
+        self.reply(1)
+        self.z.sleep(0.01)
+        self.assertEqual(len(futures), 6)
+        self.reply(4)
+        self.z.sleep(0.01)
+        self.assertEqual(len(futures), 10)
+        self.reply(4)
+        self.assertEqual([f.get() for f in futures], [b'x']*10)
+        self.assertEqual(chan.depth()['requests'], 0)
+
+    @passive
+    def test_fail_fast(self):
+        chan = self.LineChannel()
+        chan.max_bytes = 12
+        chan.block_on_overflow = False
+        # sender doesn't run until this greenlet yields
+        f1 = chan.request(b'12345\n')
+        f2 = chan.request(b'1234\n')
+        self.assertEqual(chan.depth()['bytes'], 11)
+        with self.assertRaises(self.z.channel.QueueFull):
+            chan.request(b'x\n')
+        self.reply(2)
+        self.assertEqual((f1.get(), f2.get()), (b'12345', b'1234'))
+        fut = chan.request(b'x\n')
+        self.reply(1)
+        self.assertEqual(fut.get(), b'x')
+
+    @passive
+    def test_shutdown(self):
+        chan = self.LineChannel()
+        chan.max_requests = 1
+        chan.request(b'x\n')
+        errors = []
+        def requester():
+            try:
+                chan.request(b'y\n')
+            except self.z.channel.PipeError as e:
+                errors.append(e)
+        self.hub.do_spawn(requester)
+        self.z.sleep(0.01)
+        self.server.close()
+        self.z.sleep(0.01)
+        self.assertEqual(len(errors), 1)
+        with self.assertRaises(self.z.channel.PipeError):
+            chan.push(b'z\n')
+
+    @passive
+    def test_send_buffer(self):
+        big = bytes(range(256))*4096
+        buf = self.z.channel.SendBuffer(self.client)
+        buf.add(b'head')
+        buf.add([b'small', big, b'tail'])
+        buf.add(b'')
+        self.assertEqual(len(buf.chunks), 3)
+        self.assertIs(buf.chunks[1], big)
+        expected = b'headsmall' + big + b'tail'
+        data = bytearray()
+        while len(data) < len(expected):
+            if buf:
+                try:
+                    buf.send()
+                except BlockingIOError:
+                    pass
+            self.hub.do_read(self.server)
+            data += self.server.recv(65536)
+        self.assertEqual(data, expected)
+        self.assertFalse(buf)
+        self.assertEqual(buf.offset, 0)
+        buf.add([b'', b''])
+        self.assertEqual(buf.send(), 0)
+
+    @passive
+    def test_recv_buffer(self):
+        buf = self.z.channel.RecvBuffer(min_read=16, max_read=64)
+        buf.extend(b'old')
+        with self.assertRaises(BlockingIOError):
+            buf.recv(self.client)
+        self.assertEqual(buf, b'old')
+        self.server.send(b'x'*100)
+        self.assertEqual(buf.recv(self.client), 16)
+        self.assertEqual(buf.recv(self.client), 32)
+        self.assertEqual(buf.recv(self.client), 52)
+        self.assertEqual(buf.read_size, 64)
+        self.assertEqual(buf, b'old' + b'x'*100)
+        self.server.close()
+        self.assertEqual(buf.recv(self.client), 0)
+        self.assertEqual(len(buf), 103)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
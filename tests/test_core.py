@@ -1,3 +1,9 @@
+import time
+import socket
+import threading
+import unittest
+from functools import partial
+
 from .base import Test, passive
 
 
@@ -38,6 +44,14 @@ class Core(Test):
         self.hub.do_spawn(lambda: (self.z.sleep(0.1), f.set('hello')))
         self.assertEquals(f.get(), 'hello')
 
+    @passive
+    def test_future_listeners(self):
+        f = self.z.Future()
+        waiters = [self.z.Future(f.get) for i in range(5)]
+        self.z.sleep(0.01)
+        f.set('hello')
+        self.assertEqual([w.get(timeout=0.1) for w in waiters], ['hello']*5)
+
     @passive
     def test_condition(self):
         cond = self.z.Condition()
@@ -101,7 +115,260 @@ class Core(Test):
         self.z.sleep(0.2)
         self.assertEquals(res, [1,2,3,4])
 
+    @passive
+    def test_now(self):
+        now = self.hub.now()
+        time.sleep(0.01)
+        self.assertEqual(self.hub.now(), now)
+        # deadline is counted from the cached time
+        self.z.sleep(0.01)
+        self.assertGreaterEqual(self.hub.now() - now, 0.01)
+        self.assertLessEqual(abs(self.hub.now() - time.monotonic()), 0.01)
+
+    @passive
+    def test_wait_any(self):
+        f1 = self.z.Future()
+        f2 = self.z.Future(lambda: self.z.sleep(0.02))
+        cond = self.z.Condition()
+        self.hub.do_spawn(lambda: (self.z.sleep(0.01), cond.notify()))
+        self.assertIs(self.z.wait_any(f1, f2, cond), cond)
+        self.assertIs(self.z.wait_any(f1, f2, cond), f2)
+        self.assertIs(self.z.wait_any(f1, f2, cond), f2)
+        with self.assertRaises(self.z.TimeoutError):
+            self.z.wait_any(f1, cond, timeout=0.01)
+        # nothing is left registered after wake up
+        self.assertFalse(cond._queue)
+        self.assertFalse(f1._listeners)
+
+    @passive
+    def test_wait_any_socket(self):
+        a, b = socket.socketpair()
+        c, d = socket.socketpair()
+        a.setblocking(0)
+        c.setblocking(0)
+        with a, b, c, d:
+            ra, rc = self.z.Readable(a), self.z.Readable(c)
+            self.hub.do_spawn(lambda: (self.z.sleep(0.01), d.send(b'x')))
+            self.assertIs(self.z.wait_any(ra, rc, timeout=0.2), rc)
+            self.assertEqual(c.recv(10), b'x')
+            self.assertIs(self.z.wait_any(ra, self.z.Writable(a)).sock, a)
+
+    @passive
+    def test_wait_all(self):
+        futs = [self.z.Future(partial(self.z.sleep, i*0.01))
+                for i in range(3)]
+        self.z.wait_all(*futs, timeout=0.1)
+        self.assertFalse(any(f.check() for f in futs))
+        with self.assertRaises(self.z.TimeoutError):
+            self.z.wait_all(self.z.Future(partial(self.z.sleep, 0.05)),
+                *futs, timeout=0.01)
+
+    @passive
+    def test_wait_all_conditions(self):
+        a = self.z.Condition()
+        b = self.z.Condition()
+        def notify():
+            a.notify()
+            b.notify()
+        self.hub.do_spawn(notify)
+        self.z.wait_all(a, b, timeout=0.1)
+        self.assertFalse(a._queue)
+        self.assertFalse(b._queue)
+        with self.assertRaises(self.z.TimeoutError):
+            self.z.wait_all(a, b, timeout=0.01)
+        self.assertFalse(a._queue)
+
+    @passive
+    def test_run_in_thread(self):
+        def job(i):
+            time.sleep(0.01)
+            return i*2, threading.current_thread()
+        futures = [self.hub.run_in_thread(job, i) for i in range(20)]
+        results = [f.get() for f in futures]
+        self.assertEqual([r[0] for r in results], list(range(0, 40, 2)))
+        self.assertNotIn(threading.current_thread(), [r[1] for r in results])
+        with self.assertRaises(ZeroDivisionError):
+            self.hub.run_in_thread(lambda: 1/0).get()
+
+    @passive
+    def test_call_soon_threadsafe(self):
+        items = []
+        done = self.z.Future()
+        def feed():
+            for i in range(20000):
+                self.hub.call_soon_threadsafe(items.append, i)
+            self.hub.call_soon_threadsafe(done.set, None)
+        thread = threading.Thread(target=feed)
+        thread.start()
+        done.get(timeout=5)
+        thread.join()
+        self.assertEqual(items, list(range(20000)))
+        self.assertLess(self.hub.counters['wakeups'], 20000)
+
+    @passive
+    def test_registration_cached(self):
+        a, b = socket.socketpair()
+        a.setblocking(0)
+        with a, b:
+            for i in range(10):
+                self.hub.do_spawn(lambda: b.send(b'x'))
+                self.hub.do_read(a)
+                self.assertEqual(a.recv(10), b'x')
+        stats = self.hub.poller_stats()
+        self.assertEqual(stats['register'], 1)
+        self.assertEqual(stats['modify'], 0)
+
+    @passive
+    def test_wakeups_drained(self):
+        for i in range(3000):
+            self.hub.wakeup()
+        for i in range(10):
+            self.z.sleep(0.01)
+        self.assertEqual(self.hub.counters['wakeups'], 1)
+
+    @passive
+    def test_stats(self):
+        a, b = socket.socketpair()
+        a.setblocking(0)
+        with a, b:
+            self.hub.do_spawn(lambda: (self.z.sleep(0.01), b.send(b'x')))
+            self.hub.do_read(a)
+            stats = self.hub.stats()
+            self.assertEqual(self.hub.fd_wakeups[a.fileno()], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['tasks'], 1)
+        self.assertGreaterEqual(stats['switches'], 3)
+        self.assertGreater(stats['poll_time'], 0.005)
+        self.assertGreater(stats['run_time'], 0)
+        hist = self.hub.histograms()
+        self.assertEqual(sum(hist['poll'].values()), stats['polls'])
+        self.assertTrue(0 < sum(hist['run'].values()) <= stats['iterations'])
+
+
+class SlowCallbacks(Test):
+    hub_options = {'slow_callback': 0.05, 'watchdog': 0.05}
+
+    def busy(self):
+        time.sleep(0.1)
+
+    @passive
+    def test_slow_callback(self):
+        with self.assertLogs('zorro.hub', 'WARNING') as logs:
+            for i in range(2):
+                self.hub.do_spawn(self.busy)
+            self.z.sleep(0.01)
+            self.hub.do_spawn(lambda: None)
+            self.z.sleep(0.01)
+        self.assertIn('blocked the hub', logs.output[-1])
+        [(where, count, total, max_time)] = self.hub.slowest()
+        self.assertIn('SlowCallbacks.busy', where)
+        self.assertEqual(count, 2)
+        self.assertGreaterEqual(max_time, 0.1)
+
+    @passive
+    def test_watchdog(self):
+        with self.assertLogs('zorro.hub', 'WARNING') as logs:
+            self.busy()
+        self.assertIn('Hub is blocked', logs.output[0])
+        self.assertIn('in busy', logs.output[0])
+
+
+class CoreTimerWheel(Core):
+    hub_options = {'timer_tick': 0.001}
+
+
+class CoreCoarseTimers(Core):
+    hub_options = {'timer_resolution': 0.005}
+
+    @passive
+    def test_deadline(self):
+        slots = self.hub.deadline(0.001) / 0.005
+        self.assertAlmostEqual(slots, round(slots))
+
+
+class CoreRecycle(Core):
+    hub_options = {'recycle_greenlets': 2}
+
+    @passive
+    def test_reuse(self):
+        import greenlet
+        lets = []
+        def task(fail=False):
+            lets.append(greenlet.getcurrent())
+            if fail:
+                raise RuntimeError("test error")
+        for i in range(3):
+            f = self.z.Future(partial(task, i == 1))
+            self.z.sleep(0.001)
+        self.assertEqual(len(set(lets)), 1)
+        for i in range(4):
+            self.hub.do_spawn(partial(self.z.sleep, 0.01))
+        self.z.sleep(0.05)
+        self.assertEqual(len(self.hub._idle), 2)
+        self.assertEqual(len(self.hub._tasks), 1)
+
+    @passive
+    def test_pending_timer(self):
+        done = []
+        self.hub.do_spawn(partial(self.hub.do_sleep, 0.01, more=True))
+        self.z.sleep(0.02)
+        self.assertEqual(len(self.hub._idle), 1)
+        for i in range(2):
+            self.hub.do_spawn(partial(done.append, i))
+        self.z.sleep(0.01)
+        self.assertEqual(done, [0, 1])
+        self.assertEqual(len(self.hub._idle), 2)
+
+
+class TimerWheel(unittest.TestCase):
+
+    def setUp(self):
+        from zorro.util import timerwheel
+        self.now = 1000.0
+        self.wheel = timerwheel(0.01, now=lambda: self.now)
+
+    def test_expire(self):
+        rma = self.wheel.add(1000.5, 'a')
+        rmb = self.wheel.add(1003.0, 'b')
+        self.wheel.add(1900.0, 'c')
+        self.assertEqual(self.wheel.pop(1000.4), None)
+        self.assertEqual(self.wheel.pop(1000.5), 'a')
+        rma()
+        self.assertEqual(self.wheel.pop(1002.9), None)
+        self.assertEqual(self.wheel.pop(1899.9), 'b')
+        rmb()
+        self.assertEqual(self.wheel.pop(1899.9), None)
+        self.assertEqual(self.wheel.pop(1900.0), 'c')
+
+    def test_cancel_frees(self):
+        removers = [self.wheel.add(1000 + i*0.1, i) for i in range(10000)]
+        self.assertEqual(len(self.wheel), 10000)
+        for rm in removers:
+            rm()
+        self.assertEqual(len(self.wheel), 0)
+        self.assertFalse(self.wheel)
+        self.assertEqual(self.wheel.min(), None)
+        self.assertEqual(self.wheel.pop(3000), None)
+
+
+class OrderedSet(unittest.TestCase):
+
+    def test_fifo_remove(self):
+        from zorro.util import orderedset
+        queue = orderedset()
+        rm = [queue.add(i, 'x') for i in range(5)]
+        rm[2]()
+        rm[0]()
+        rm[2]()  # removing twice is harmless
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.first(), (1, 'x'))
+        rm[1]()
+        self.assertEqual(queue.first(), (3, 'x'))
+        rm[3]()
+        rm[4]()
+        self.assertFalse(queue)
+        self.assertEqual(queue.first(), None)
+
 
 if __name__ == '__main__':
-    import unittest
     unittest.main()
@@ -1,7 +1,9 @@
 import time
+import threading
 import http.server
+import socketserver
 
-from .base import Test, interactive
+from .base import Test, interactive, passive
 
 
 class RequestHandler(http.server.BaseHTTPRequestHandler):
@@ -50,6 +52,94 @@ class Simple(Test):
         self.assertEqual(self.fetched_value, b'HELLO')
 
 
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.05)
+        if self.path == '/host':
+            body = self.headers['Host'].encode('ascii')
+        else:
+            body = self.path.encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Pool(Test):
+
+    def setUp(self):
+        super().setUp()
+        import zorro.http
+        self.srv = Server(('localhost', 9996), KeepAliveHandler)
+        threading.Thread(target=self.srv.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        super().tearDown()
+        self.srv.shutdown()
+        self.srv.server_close()
+
+    @passive
+    def test_connections(self):
+        pool = self.z.http.HTTPPool(max_connections=2)
+        url = 'http://localhost:9996/slow'
+        futures = [self.z.Future(lambda: pool.request(url).body)
+                   for i in range(4)]
+        self.assertEqual([f.get() for f in futures], [b'/slow']*4)
+        host = pool._hosts['http', 'localhost', 9996]
+        self.assertEqual(len(host.channels), 2)
+        self.assertEqual(pool.request('http://localhost:9996/a?b=c').body,
+            b'/a?b=c')
+        self.assertEqual(len(host.channels), 2)
+        pool.close()
+
+    @passive
+    def test_reconnect(self):
+        pool = self.z.http.HTTPPool(max_connections=1, idle_timeout=0.05)
+        url = 'http://localhost:9996/'
+        self.assertEqual(pool.request(url).body, b'/')
+        host = pool._hosts['http', 'localhost', 9996]
+        chan = host.channels[0]
+        chan.close()
+        self.z.sleep(0.01)
+        self.assertEqual(pool.request(url).body, b'/')
+        self.assertIsNot(host.channels[0], chan)
+        chan = host.channels[0]
+        self.z.sleep(0.1)
+        self.assertEqual(pool.request(url).body, b'/')
+        self.assertFalse(chan)  # closed as idle
+        pool.close()
+
+    @passive
+    def test_idle(self):
+        pool = self.z.http.HTTPPool(idle_timeout=0.05)
+        self.assertEqual(pool.request('http://localhost:9996/').body, b'/')
+        chan = pool._hosts['http', 'localhost', 9996].channels[0]
+        self.z.sleep(0.1)
+        self.assertFalse(chan)
+        self.assertEqual(pool._hosts, {})
+        self.z.sleep(0.01)
+        self.assertIsNone(pool._reaper)
+
+    @passive
+    def test_host(self):
+        pool = self.z.http.HTTPPool()
+        self.assertEqual(
+            pool.request('http://user:pw@localhost:9996/host').body,
+            b'localhost:9996')
+        pool.close()
+
+
 if __name__ == '__main__':
     import unittest
     unittest.main()
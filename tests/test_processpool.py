@@ -0,0 +1,120 @@
+import os
+import time
+import logging
+
+from .base import Test, passive
+
+
+def square(x):
+    return x*x
+
+
+def reverse(data, *, tail=b''):
+    return bytes(reversed(data)) + tail, os.getpid()
+
+
+def fail(msg):
+    raise ValueError(msg)
+
+
+def slow_result(size):
+    time.sleep(0.05)
+    return b'z'*size
+
+
+def die(*args):
+    os._exit(1)
+
+
+def shm_segments():
+    return set(os.listdir('/dev/shm'))
+
+
+class ProcessPool(Test):
+    test_timeout = 5
+
+    def setUp(self):
+        super().setUp()
+        import zorro.processpool
+
+    @passive
+    def test_call(self):
+        pool = self.z.processpool.ProcessPool(2)
+        self.assertEqual(pool.call(square, 7), 49)
+        futs = [pool.submit(square, i) for i in range(10)]
+        self.assertEqual([f.get() for f in futs], [i*i for i in range(10)])
+        self.assertEqual(len(pool._channels), 2)
+        pool.close()
+        self.assertFalse(pool._pids)
+
+    @passive
+    def test_throttled(self):
+        cls = self.z.processpool.WorkerChannel
+        cls.max_requests = 1
+        try:
+            pool = self.z.processpool.ProcessPool(1)
+            futs = [self.z.Future(lambda i=i: pool.call(square, i))
+                    for i in range(3)]
+            self.assertEqual([f.get() for f in futs], [0, 1, 4])
+            self.assertEqual(pool._channels[0].depth(),
+                {'requests': 0, 'bytes': 0, 'throttled': False})
+            pool.close()
+        finally:
+            del cls.max_requests
+
+    @passive
+    def test_shared_memory(self):
+        pool = self.z.processpool.ProcessPool(1, shm_threshold=1024)
+        data = os.urandom(1 << 20)
+        res, pid = pool.call(reverse, data, tail=b'x'*2048)
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(res, data[::-1] + b'x'*2048)
+        pool.close()
+
+    @passive
+    def test_exception(self):
+        pool = self.z.processpool.ProcessPool(1)
+        with self.assertRaisesRegex(ValueError, 'bad'):
+            pool.call(fail, 'bad')
+        self.assertEqual(pool.call(square, 3), 9)
+        pool.close()
+
+    @passive
+    def test_worker_died(self):
+        pool = self.z.processpool.ProcessPool(1, shm_threshold=1024)
+        before = shm_segments()
+        died = pool.submit(die, b'x'*2048)
+        queued = pool.submit(reverse, b'y'*2048)
+        with self.assertRaises(self.z.channel.PipeError):
+            died.get()
+        with self.assertRaises(self.z.channel.PipeError):
+            queued.get()
+        self.assertEqual(shm_segments() - before, set())
+        self.assertEqual(pool.call(square, 3), 9)
+        pool.close()
+
+    @passive
+    def test_result_not_read(self):
+        pool = self.z.processpool.ProcessPool(1, shm_threshold=1024)
+        self.assertEqual(pool.call(square, 3), 9)
+        before = shm_segments()
+        fut = pool.submit(slow_result, 2048)
+        self.z.sleep(0.01)  # job is sent
+        pool.close()
+        with self.assertRaises(self.z.channel.PipeError):
+            fut.get()
+        self.assertEqual(shm_segments() - before, set())
+
+    @passive
+    def test_close_quietly(self):
+        pool = self.z.processpool.ProcessPool(2)
+        self.assertEqual(pool.call(square, 3), 9)
+        with self.assertLogs('zorro', 'WARNING') as logs:
+            logging.getLogger('zorro').warning('closing')
+            pool.close()
+        self.assertEqual(logs.output, ['WARNING:zorro:closing'])
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import socket
+import logging
+import unittest
+from functools import partial
 
 from .base import Test, passive
 
@@ -23,7 +26,7 @@ class SingleThread(Redis):
     @passive
     def test_reconnect(self):
         self.assertEquals(self.r.execute('SET', 'test:key1', 'value'), 'OK')
-        self.r._channel._sock.shutdown(socket.SHUT_RDWR)
+        self.r._channels[0]._sock.shutdown(socket.SHUT_RDWR)
         self.z.sleep(0.01)
         self.assertEquals(self.r.execute('GET', 'test:key1'), b'value')
         self.assertEquals(self.r.execute('DEL', 'test:key1'), 1)
@@ -32,11 +35,29 @@ class SingleThread(Redis):
     def test_disconnect(self):
         fut = self.r.future('SET',
             'test:big', b'0123456789abcdef'*1000000)
-        self.r._channel._sock.shutdown(socket.SHUT_RDWR)
+        self.r._channels[0]._sock.shutdown(socket.SHUT_RDWR)
         self.z.sleep(0.01)
         with self.assertRaises(self.z.channel.PipeError):
             fut.get()
 
+    @passive
+    def test_pool(self):
+        r = self.z.redis.Redis(db=13, pool_size=3)
+        self.assertEquals(r.execute('SET', 'test:key1', 'value'), 'OK')
+        self.z.sleep(0.01)  # others connect in background
+        self.assertEqual(len(r._channels), 3)
+        futs = [r.future('GET', 'test:key1') for i in range(6)]
+        self.assertEqual([len(c._producing) for c in r._channels],
+            [2, 2, 2])
+        self.assertEqual([f.get() for f in futs], [b'value']*6)
+        r._channels[1]._sock.shutdown(socket.SHUT_RDWR)
+        self.z.sleep(0.01)
+        self.assertEqual(r.execute('GET', 'test:key1'), b'value')
+        self.z.sleep(0.01)
+        self.assertEqual(len(r._channels), 3)
+        self.assertTrue(all(r._channels))
+        self.assertEquals(r.execute('DEL', 'test:key1'), 1)
+
     @passive
     def test_bulk(self):
         self.assertEquals(self.r.bulk([
@@ -67,6 +88,374 @@ class SingleThread(Redis):
         self.assertEquals(self.r.execute('DEL', 'test:key2'), 1)
 
 
+class Batching(Redis):
+
+    def setUp(self):
+        super().setUp()
+        import zorro.redis
+        self.r = zorro.redis.Redis(db=13, batch_size=4)
+
+    @passive
+    def test_batch(self):
+        self.r.execute('DEL', 'test:counter')
+        chan = self.r._channels[0]
+        writes = []
+        def request_many(input, futures):
+            writes.append(len(futures))
+            return type(chan).request_many(chan, input, futures)
+        chan.request_many = request_many
+        futures = [self.z.Future(partial(self.r.execute, 'INCR', 'test:counter'))
+                   for i in range(10)]
+        self.assertEqual(sorted(f.get() for f in futures), list(range(1, 11)))
+        self.assertEqual(writes, [4, 4, 2])
+        self.assertEqual(self.r.execute('DEL', 'test:counter'), 1)
+
+    @passive
+    def test_order(self):
+        self.r.execute('SET', 'test:key1', 'old')
+        fut = self.r.future('SET', 'test:key1', 'new')
+        self.assertEqual(self.r.pipeline([('GET', 'test:key1')]), (b'new',))
+        self.assertEqual(fut.get(), 'OK')
+        fut = self.r.future('SET', 'test:key1', 'bulk')
+        self.assertEqual(self.r.bulk([('MULTI',), ('GET', 'test:key1'),
+            ('EXEC',)]), [b'bulk'])
+        self.assertEqual(self.r.execute('DEL', 'test:key1'), 1)
+
+    @passive
+    def test_script(self):
+        script = self.r.script('return {KEYS[1], ARGV[1]}')
+        self.assertEqual(script(['test:key1'], ['a']), [b'test:key1', b'a'])
+        self.assertEqual(self.r.execute('EVALSHA', script.sha, 1, 'k', 'b'),
+            [b'k', b'b'])
+        self.assertEqual(script(['test:key1'], ['c']), [b'test:key1', b'c'])
+
+
+class Scan(Redis):
+
+    @passive
+    def test_prefetch(self):
+        keys = ['test:scan:{}'.format(i) for i in range(20)]
+        self.r.execute('MSET', *[k for key in keys for k in (key, 'x')])
+        calls = []
+        execute = self.r.execute
+        def counted(*args):
+            calls.append(args[0])
+            return execute(*args)
+        self.r.execute = counted
+        it = self.r.scan('test:scan:*', count=2, prefetch=2)
+        first = next(it)
+        self.z.sleep(0.01)
+        self.assertEqual(len(calls), 3)  # current page and two prefetched
+        it.close()
+        self.z.sleep(0.01)
+        self.assertEqual(len(calls), 3)
+        found = set(self.r.scan('test:scan:*', count=3))
+        self.assertEqual(found, set(k.encode('ascii') for k in keys))
+        self.assertIn(first, found)
+        with self.assertRaises(ValueError):
+            next(self.r.scan('test:scan:*', prefetch=0))
+        self.assertEqual(execute('DEL', *keys), 20)
+
+    @passive
+    def test_collections(self):
+        self.r.execute('HSET', 'test:hash', 'a', '1', 'b', '2')
+        self.r.execute('SADD', 'test:set', 'a', 'b', 'c')
+        self.r.execute('ZADD', 'test:zset', '1', 'a', '2.5', 'b')
+        items = sorted(self.r.hscan('test:hash', count=1))
+        self.assertEqual(items, [(b'a', b'1'), (b'b', b'2')])
+        self.assertEqual({type(v) for item in items for v in item}, {bytes})
+        self.assertEqual(sorted(self.r.sscan('test:set', 'b*')), [b'b'])
+        self.assertEqual(sorted(self.r.zscan('test:zset')),
+            [(b'a', 1.0), (b'b', 2.5)])
+        self.r.execute('DEL', 'test:hash', 'test:set', 'test:zset')
+
+
+class Parser(unittest.TestCase):
+
+    def test_chunks(self):
+        from zorro.redis import ReplyParser, RedisError
+        data = (b'+OK\r\n:-12\r\n$5\r\nab\r\nc\r\n$-1\r\n*0\r\n'
+                b'*3\r\n$1\r\na\r\n*2\r\n:1\r\n$0\r\n\r\n$-1\r\n'
+                b'-ERR wrong\r\n*2\r\n$2\r\nxy\r\n+QUEUED\r\n')
+        for step in (1, 2, 3, 7, len(data)):
+            replies = []
+            parse = ReplyParser().parse
+            buf = bytearray()
+            pos = 0
+            for i in range(0, len(data), step):
+                buf += data[i:i+step]
+                pos = parse(buf, pos, replies.append)
+            self.assertEqual(pos, len(data))
+            err = replies.pop(6)
+            self.assertIsInstance(err, RedisError)
+            self.assertEqual(err.args, ('ERR wrong',))
+            self.assertEqual(replies, ['OK', -12, b'ab\r\nc', None, [],
+                [b'a', [1, b''], None], [b'xy', 'QUEUED']])
+
+
+class Encoding(unittest.TestCase):
+
+    def reference(self, *parts):
+        res = '*{}\r\n'.format(len(parts)).encode('ascii')
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            elif isinstance(part, (int, float)):
+                part = repr(part).encode('ascii')
+            res += '${}\r\n'.format(len(part)).encode('ascii')
+            res += part + b'\r\n'
+        return res
+
+    def test_encode(self):
+        from zorro.redis import encode_commands, LARGE_VALUE
+        cmds = [
+            ('GET', 'test:key'),
+            (b'SET', 'test:ключ', bytearray(b'value')),
+            ('HSET', 'h', 10, 1.5),
+            ('SET', 'test:key', b'x'*5000),
+            ('MSET',) + ('k', 'v')*20,
+            ]
+        for i in range(2):  # second time command names are cached
+            self.assertEqual(encode_commands(cmds),
+                b''.join(self.reference(*c) for c in cmds))
+        big = b'y'*LARGE_VALUE
+        chunks = encode_commands([('SET', 'a', big), ('GET', 'a')])
+        self.assertIs(chunks[1], big)
+        self.assertEqual(b''.join(chunks),
+            self.reference('SET', 'a', big) + self.reference('GET', 'a'))
+
+    def test_encode_time(self):
+        from zorro.redis import encode_commands
+        import time
+        cmds = [('GET', 'test:key1'), ('INCR', b'test:counter'),
+                ('SET', 'test:key1', b'value')]*10
+        old = time.time()
+        for i in range(10000):
+            encode_commands(cmds)
+        print("ENCODE TIME", time.time() - old)
+
+
+class Sharded(Redis):
+
+    def setUp(self):
+        super().setUp()
+        self.s = self.z.redis.ShardedRedis([
+            self.z.redis.Redis(db=13),
+            self.z.redis.Redis(db=14),
+            ])
+
+    @passive
+    def test_ring(self):
+        keys = ['test:key{}'.format(i) for i in range(1000)]
+        shards = [self.s.shard_index(k) for k in keys]
+        self.assertGreater(shards.count(0), 300)
+        self.assertGreater(shards.count(1), 300)
+        self.assertEqual(self.s.shard_index(b'test:key1'), shards[1])
+        three = self.z.redis.ShardedRedis(self.s.shards + ['localhost:6380'])
+        for key, idx in zip(keys, shards):
+            new = three.shard_index(key)
+            self.assertIn(new, (idx, 2))
+
+    @passive
+    def test_multi_key(self):
+        keys = ['test:key{}'.format(i) for i in range(10)]
+        args = []
+        for k in keys:
+            args.extend((k, k + ':value'))
+        self.assertEqual(self.s.execute('MSET', *args), 'OK')
+        self.assertEqual(self.s.execute('GET', keys[3]), b'test:key3:value')
+        self.assertEqual(self.s.execute('MGET', *keys + ['test:nokey']),
+            [k.encode('ascii') + b':value' for k in keys] + [None])
+        self.assertEqual(self.s.pipeline([
+            ('GET', keys[5]),
+            ('DEL', keys[0], keys[1], keys[2]),
+            ('MGET', keys[0], keys[9]),
+            ]), [b'test:key5:value', 3, [None, b'test:key9:value']])
+        self.assertEqual(self.s.execute('DEL', *keys), 7)
+
+
+class PubSub(Redis):
+
+    @passive
+    def test_subscribe(self):
+        sub = self.z.redis.Subscriber()
+        got = []
+        sub.subscribe(lambda c, m: got.append((c, m)),
+            'test:chan1', 'test:chan2')
+        sub.psubscribe(lambda c, m: got.append(('pattern', c, m)),
+            'test:pat*')
+        self.z.sleep(0.01)
+        self.assertEqual(self.r.execute('PUBLISH', 'test:chan1', 'a'), 1)
+        self.assertEqual(self.r.execute('PUBLISH', 'test:pat1', 'b'), 1)
+        self.z.sleep(0.01)
+        self.assertEqual(got, [(b'test:chan1', b'a'),
+                               ('pattern', b'test:pat1', b'b')])
+        sub.unsubscribe('test:chan1')
+        self.z.sleep(0.01)
+        self.assertEqual(self.r.execute('PUBLISH', 'test:chan1', 'c'), 0)
+        self.assertEqual(self.r.execute('PUBLISH', 'test:chan2', 'd'), 1)
+        self.z.sleep(0.01)
+        self.assertEqual(got[-1], (b'test:chan2', b'd'))
+        sub.close()
+
+    @passive
+    def test_reconnect(self):
+        sub = self.z.redis.Subscriber()
+        got = []
+        sub.subscribe(lambda c, m: got.append(m), 'test:chan1')
+        self.z.sleep(0.01)
+        sub._channel._sock.shutdown(socket.SHUT_RDWR)
+        self.z.sleep(0.01)
+        self.assertTrue(sub.subscribed('test:chan1'))
+        self.assertEqual(self.r.execute('PUBLISH', 'test:chan1', 'a'), 1)
+        self.z.sleep(0.01)
+        self.assertEqual(got, [b'a'])
+        sub.close()
+
+    @passive
+    def test_unsubscribe_all(self):
+        sub = self.z.redis.Subscriber()
+        got = []
+        sub.subscribe(got.append)  # nothing to subscribe yet
+        sub.subscribe(lambda c, m: got.append(m), 'test:chan1', 'test:chan2')
+        sub.psubscribe(lambda c, m: got.append(m), 'test:pat*')
+        self.z.sleep(0.01)
+        chan = sub._channel
+        with self.assertLogs('zorro', 'WARNING') as logs:
+            logging.getLogger('zorro').warning('unsubscribing')
+            sub.unsubscribe()
+            sub.punsubscribe()
+            self.z.sleep(0.01)
+            sub.unsubscribe()  # from nothing
+            self.z.sleep(0.01)
+        self.assertEqual(logs.output, ['WARNING:zorro:unsubscribing'])
+        self.assertIs(sub._channel, chan)
+        self.assertTrue(chan)
+        self.assertEqual(sub._confirmed, set())
+        self.assertEqual(self.r.execute('PUBLISH', 'test:chan1', 'a'), 0)
+        self.assertEqual(self.r.execute('PUBLISH', 'test:pat1', 'b'), 0)
+        sub.subscribe(lambda c, m: got.append(m), 'test:chan1')
+        self.z.sleep(0.01)
+        self.assertEqual(self.r.execute('PUBLISH', 'test:chan1', 'c'), 1)
+        self.z.sleep(0.01)
+        self.assertEqual(got, [b'c'])
+        sub.close()
+
+    @passive
+    def test_reconnect_patterns(self):
+        sub = self.z.redis.Subscriber()
+        got = []
+        sub.psubscribe(lambda c, m: got.append(m), 'test:pat*')
+        self.z.sleep(0.01)
+        sub._channel._sock.shutdown(socket.SHUT_RDWR)
+        self.z.sleep(0.01)
+        self.assertTrue(sub.subscribed('test:pat*', pattern=True))
+        self.assertEqual(self.r.execute('PUBLISH', 'test:pat1', 'a'), 1)
+        self.z.sleep(0.01)
+        self.assertEqual(got, [b'a'])
+        sub.close()
+
+    @passive
+    def test_pool(self):
+        from zorro.pool import Pool
+        running = []
+        def callback(chan, msg):
+            running.append(msg)
+            self.z.sleep(0.05)
+            running.remove(msg)
+        sub = self.z.redis.Subscriber()
+        sub.subscribe(Pool(callback, limit=2, timeout=1), 'test:chan1')
+        self.z.sleep(0.01)
+        for i in range(4):
+            self.r.execute('PUBLISH', 'test:chan1', str(i))
+        self.z.sleep(0.02)
+        self.assertEqual(running, [b'0', b'1'])
+        self.z.sleep(0.05)
+        self.assertEqual(running, [b'2', b'3'])
+        sub.close()
+
+
+class Cache(Redis):
+
+    def make_cache(self, **kwargs):
+        cache = self.z.redis.Cache(self.r, **kwargs)
+        cache._coherent()
+        self.z.sleep(0.01)
+        self.assertTrue(cache._coherent())
+        return cache
+
+    @passive
+    def test_unconfirmed(self):
+        cache = self.z.redis.Cache(self.r)
+        self.r.execute('SET', 'test:cache', 'a')
+        self.assertEqual(cache.get('test:cache'), b'a')
+        self.assertFalse(cache._values)
+        self.z.sleep(0.01)  # subscription is confirmed
+        self.assertEqual(cache.get('test:cache'), b'a')
+        self.assertEqual(cache.get('test:cache'), b'a')
+        self.assertEqual(cache.counters['hits'], 1)
+        self.assertEqual(cache.counters['misses'], 2)
+        self.r.execute('DEL', 'test:cache')
+        cache._subscriber.close()
+
+    @passive
+    def test_invalidate(self):
+        cache = self.make_cache()
+        self.r.execute('SET', 'test:cache', 'a')
+        self.assertEqual(cache.get('test:cache'), b'a')
+        self.assertEqual(cache.get('test:cache'), b'a')
+        self.assertEqual(cache.get('test:missing'), None)
+        self.assertEqual(cache.get('test:missing'), None)
+        self.assertEqual(cache.counters['hits'], 2)
+        self.assertEqual(cache.counters['misses'], 2)
+        self.r.execute('SET', 'test:cache', 'b')
+        self.z.sleep(0.01)
+        self.assertEqual(cache.counters['invalidations'], 1)
+        self.assertEqual(cache.get('test:cache'), b'b')
+        self.assertEqual(cache.counters['misses'], 3)
+        self.r.execute('DEL', 'test:cache')
+        cache._subscriber.close()
+
+    @passive
+    def test_coalesce(self):
+        cache = self.make_cache()
+        self.r.execute('SET', 'test:cache', 'a')
+        futures = [self.z.Future(lambda: cache.get('test:cache'))
+                   for i in range(10)]
+        self.assertEqual([f.get() for f in futures], [b'a']*10)
+        self.assertEqual(cache.counters['misses'], 1)
+        self.assertEqual(cache.counters['coalesced'], 9)
+        self.r.execute('DEL', 'test:cache')
+        cache._subscriber.close()
+
+    @passive
+    def test_lru(self):
+        cache = self.make_cache(size=2)
+        self.r.execute('MSET', 'test:k1', '1', 'test:k2', '2', 'test:k3', '3')
+        cache.get('test:k1')
+        cache.get('test:k2')
+        cache.get('test:k1')
+        cache.get('test:k3')  # evicts k2
+        self.assertEqual(cache.counters['evictions'], 1)
+        self.assertEqual(list(cache._values), [b'test:k1', b'test:k3'])
+        self.r.execute('DEL', 'test:k1', 'test:k2', 'test:k3')
+        cache._subscriber.close()
+
+    @passive
+    def test_ttl(self):
+        cache = self.make_cache(ttl=0.02)
+        self.r.execute('SET', 'test:cache', 'a')
+        cache.get('test:cache')
+        cache.get('test:cache')
+        self.z.sleep(0.03)
+        cache.get('test:cache')
+        self.assertEqual(cache.counters['hits'], 1)
+        self.assertEqual(cache.counters['expirations'], 1)
+        self.assertEqual(cache.counters['misses'], 2)
+        self.r.execute('DEL', 'test:cache')
+        cache._subscriber.close()
+
+
 class BigTest(Redis):
     test_timeout = 10
 
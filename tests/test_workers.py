@@ -0,0 +1,74 @@
+import os
+import socket
+import unittest
+
+from .base import Test, interactive
+
+
+class Workers(Test):
+    test_timeout = 5
+
+    def setUp(self):
+        super().setUp()
+        import zorro.workers
+        self.rsock, self.wsock = socket.socketpair()
+
+    def tearDown(self):
+        super().tearDown()
+        self.rsock.close()
+        self.wsock.close()
+
+    def start_workers(self):
+        def worker():
+            hub = self.z.gethub()
+            hub.do_spawnservice(lambda: self.z.sleep(100))
+            self.wsock.send('{} {}\n'.format(hub.worker_index, os.getpid())
+                .encode('ascii'))
+        self.sup = self.z.workers.Supervisor(worker, workers=3)
+        self.sup.start()
+
+    def read_workers(self, num):
+        buf = b''
+        self.rsock.settimeout(self.test_timeout)
+        while buf.count(b'\n') < num:
+            buf += self.rsock.recv(1024)
+        return dict(map(int, line.split())
+                    for line in buf.decode('ascii').splitlines())
+
+    def assert_dead(self, pids):
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+    @interactive(start_workers)
+    def test_stop(self):
+        workers = self.read_workers(3)
+        self.assertEqual(set(workers), {0, 1, 2})
+        self.hub.stop()
+        self.thread.join(self.test_timeout)
+        self.assertFalse(self.thread.is_alive())
+        self.assert_dead(workers.values())
+
+    @interactive(start_workers)
+    def test_restart(self):
+        workers = self.read_workers(3)
+        os.kill(workers[1], 9)
+        restarted = self.read_workers(1)
+        self.assertEqual(list(restarted), [1])
+        self.assertNotEqual(restarted[1], workers[1])
+        self.hub.stop()
+        self.thread.join(self.test_timeout)
+        self.assert_dead([workers[0], workers[2], restarted[1]])
+
+
+class ListenSocket(unittest.TestCase):
+
+    def test_unix_socket(self):
+        from zorro.workers import listen_socket
+        with self.assertRaises(ValueError):
+            listen_socket('/tmp/zorro-test.sock')
+        self.assertFalse(os.path.exists('/tmp/zorro-test.sock'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ from functools import wraps
 from contextlib import contextmanager
 
 from .core import Hub, gethub, Future, Condition, Lock, TimeoutError
+from .core import Readable, Writable, wait_any, wait_all
 
 
 __version__ = '0.2.a0'
@@ -13,6 +14,10 @@ __all__ = [
     'Future',
     'Condition',
     'Lock',
+    'Readable',
+    'Writable',
+    'wait_any',
+    'wait_all',
     ]
 
 
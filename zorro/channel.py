@@ -1,4 +1,6 @@
+import os
 from collections import deque
+from itertools import islice
 import logging
 
 from greenlet import GreenletExit
@@ -17,10 +19,170 @@ class ShutdownException(Exception):
     pass
 
 
+class QueueFull(PipeError):
+    """Request is rejected because channel is over its limits"""
+
+
+def request_size(input):
+    """Number of bytes in a request, either a buffer or a list of them"""
+    if isinstance(input, (bytes, bytearray, memoryview)):
+        return len(input)
+    if isinstance(input, (list, tuple)):
+        return sum(len(i) for i in input
+                   if isinstance(i, (bytes, bytearray, memoryview)))
+    return 0
+
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+if IOV_MAX <= 0:
+    IOV_MAX = 16
+
+
+class SendBuffer(object):
+    """Output queue of a socket which doesn't copy large buffers
+
+    Chunks are kept as is and written with ``sendmsg``, partially written
+    chunk is sent from an offset. Chunks smaller than ``coalesce`` bytes are
+    copied together, to not make an iovec of every few bytes. Added
+    buffers must not be changed until they are sent.
+
+    With ``scatter=False`` (e.g. for ssl sockets, which have no
+    ``sendmsg``) each ``send()`` writes a single chunk.
+    """
+
+    def __init__(self, sock, *, coalesce=4096, scatter=True):
+        self.sock = sock
+        self.coalesce = coalesce
+        self.scatter = scatter and hasattr(sock, 'sendmsg')
+        self.chunks = deque()
+        self.offset = 0  # sent bytes of the first chunk
+        self._tail = None  # bytearray where small chunks are collected
+
+    def add(self, chunk):
+        """Adds a bytes-like object or a list of them"""
+        if isinstance(chunk, (list, tuple)):
+            for i in chunk:
+                self.add(i)
+            return
+        ln = len(chunk)
+        if not ln:
+            return
+        if ln >= self.coalesce:
+            self.chunks.append(chunk)
+            self._tail = None
+        elif self._tail is not None:
+            self._tail += chunk
+        else:
+            self._tail = bytearray(chunk)
+            self.chunks.append(self._tail)
+
+    def send(self):
+        """Writes as much as socket accepts, returns number of bytes sent
+
+        Zero is returned without a system call if there is nothing to send
+        (e.g. only empty chunks were added). Socket errors are propagated
+        """
+        chunks = self.chunks
+        if not chunks:
+            return 0
+        head = memoryview(chunks[0])[self.offset:]
+        try:
+            if self.scatter and len(chunks) > 1:
+                sent = self.sock.sendmsg(
+                    [head] + list(islice(chunks, 1, IOV_MAX)))
+            else:
+                sent = self.sock.send(head)
+        finally:
+            head.release()
+        left = sent
+        while left:
+            ln = len(chunks[0]) - self.offset
+            if left < ln:
+                self.offset += left
+                break
+            left -= ln
+            self.offset = 0
+            if chunks.popleft() is self._tail:
+                self._tail = None
+        return sent
+
+    def __bool__(self):
+        return bool(self.chunks)
+
+
+class RecvBuffer(bytearray):
+    """Input buffer of a socket, which data is received directly into
+
+    Parsers use it as a plain bytearray. Each ``recv()`` reads at most
+    ``read_size`` bytes, which starts at ``min_read`` and is doubled
+    every time the read fills it (up to ``max_read``), so big replies are
+    read in few system calls. No memoryviews of the buffer may be kept,
+    as they don't allow it to be resized.
+    """
+    _zeros = None
+
+    def __init__(self, *, min_read=16384, max_read=1 << 20):
+        self.min_read = min_read
+        self.max_read = max_read
+        self.read_size = min_read
+
+    def recv(self, sock):
+        """Appends data from ``sock``, returns number of bytes read
+
+        Zero means the connection is closed, socket errors are propagated
+        """
+        size = self.read_size
+        zeros = self._zeros
+        if zeros is None or len(zeros) < size:
+            zeros = RecvBuffer._zeros = memoryview(bytes(self.max_read))
+        end = len(self)
+        self.extend(zeros[:size])
+        num = 0
+        try:
+            view = memoryview(self)[end:]
+            try:
+                num = sock.recv_into(view)
+            finally:
+                view.release()
+        finally:
+            del self[end+num:]
+        if num == size:
+            if size < self.max_read:
+                self.read_size = size*2
+        elif num*4 < size and size > self.min_read:
+            self.read_size = size//2
+        return num
+
+
 class BaseChannel(object):
+    """Base for channels with a sender and a receiver greenlet
+
+    Limits (class attributes, may be overriden per instance):
+
+    ``max_requests``
+        number of requests sent or queued, but not replied yet
+    ``max_bytes``
+        size of requests queued and not taken by the sender yet
+    ``low_water``
+        when a limit is hit, requests are accepted again only after
+        both values are below ``low_water`` of the limits
+    ``block_on_overflow``
+        whether ``request()`` waits for the room, or raises ``QueueFull``
+    """
+    max_requests = None
+    max_bytes = None
+    low_water = 0.5
+    block_on_overflow = True
+
     def __init__(self):
         self._alive = True
         self._pending = deque()
+        self._pending_bytes = 0
+        self._throttled = False
+        self._room = Condition()
         self._cond = Condition()
         self._sender_alive = True
         self._receiver_alive = True
@@ -42,11 +204,13 @@ class BaseChannel(object):
         except (EOFError, ShutdownException, GreenletExit) as e:
             pass
         except Exception:
-            log.exception("Error in %r's sender", self)
+            if self._alive:  # otherwise it's closed on purpose
+                log.exception("Error in %r's sender", self)
         finally:
             if self._alive:
                 self._alive = False
                 self._stop_producing()
+                self._room.notify_all()
             self._sender_alive = False
             if not self._receiver_alive:
                 # both are down
@@ -58,11 +222,13 @@ class BaseChannel(object):
         except (EOFError, ShutdownException, GreenletExit) as e:
             pass
         except Exception:
-            log.exception("Error in %r's receiver", self)
+            if self._alive:  # otherwise it's closed on purpose
+                log.exception("Error in %r's receiver", self)
         finally:
             if self._alive:
                 self._alive = False
                 self._stop_producing()
+                self._room.notify_all()
             self._receiver_alive = False
             if not self._sender_alive:
                 # both are down
@@ -71,12 +237,85 @@ class BaseChannel(object):
     def _stop_producing(self):
         pass
 
+    def _outstanding(self):
+        """Number of requests waiting for reply"""
+        return len(self._pending)
+
+    def _item_size(self, item):
+        return request_size(item)
+
+    def depth(self):
+        """Current queue depth, to be compared with the limits"""
+        return {
+            'requests': self._outstanding() if self._alive else 0,
+            'bytes': self._pending_bytes,
+            'throttled': self._throttled,
+            }
+
+    def _over_limit(self, size):
+        if self.max_requests is not None and \
+            self._outstanding() >= self.max_requests:
+            return True
+        if self.max_bytes is not None and self._pending_bytes and \
+            self._pending_bytes + size > self.max_bytes:
+            return True
+        return False
+
+    def _wait_room(self, size):
+        if not self._alive:
+            raise PipeError()
+        while True:
+            if not self._throttled:
+                if not self._over_limit(size):
+                    return
+                self._throttled = True
+            if not self.block_on_overflow:
+                raise QueueFull()
+            self._room.wait()
+            if not self._alive:
+                raise PipeError()
+
+    def _release(self):
+        """Called when requests are sent or replied"""
+        if not self._throttled or not self._alive:
+            return
+        low = self.low_water
+        if self.max_requests is not None and \
+            self._outstanding() > self.max_requests * low:
+            return
+        if self.max_bytes is not None and \
+            self._pending_bytes > self.max_bytes * low:
+            return
+        self._throttled = False
+        self._room.notify_all()
+
+    def _reply(self, fut, value, exception=None):
+        """Completes ``fut`` of a replied request and releases the room
+
+        The request must be already removed from the outstanding ones, all
+        replies of subclasses should come through here, or throttled
+        channel will never accept requests again.
+        """
+        if exception is None:
+            fut.set(value)
+        else:
+            fut.throw(exception)
+        self._release()
+
+    def _enqueue(self, item):
+        self._pending_bytes += self._item_size(item)
+        self._pending.append(item)
+        self._cond.notify()
+
     def peek_request(self):
         self.wait_requests()
         return self._pending[0]
 
     def pop_request(self):
-        return self._pending.popleft()
+        item = self._pending.popleft()
+        self._pending_bytes -= self._item_size(item)
+        self._release()
+        return item
 
     def wait_requests(self):
         while not self._pending:
@@ -86,7 +325,7 @@ class BaseChannel(object):
 
     def get_pending_requests(self):
         while self._pending:
-            yield self._pending.popleft()
+            yield self.pop_request()
 
 
 class PipelinedReqChannel(BaseChannel):
@@ -103,6 +342,13 @@ class PipelinedReqChannel(BaseChannel):
             fut.throw(PipeError())
         self._cond.notify()  # wake up consumer if it waits for messages
 
+    def _outstanding(self):
+        return len(self._producing)
+
+    def _produced(self, value, exception=None):
+        """Completes the oldest outstanding request"""
+        self._reply(self._producing.popleft()[1], value, exception)
+
     def produce(self, value):
         if not self._alive:
             raise ShutdownException()
@@ -110,27 +356,34 @@ class PipelinedReqChannel(BaseChannel):
         num = self._producing[0][0]
         if num is None:
             del self._cur_producing[:]
-            self._producing.popleft()[1].set(value)
+            self._produced(value)
         elif len(self._cur_producing) >= num:
             res = tuple(self._cur_producing)
             del self._cur_producing[:]
-            self._producing.popleft()[1].set(res)
-        else:
-            return
+            self._produced(res)
 
     def request(self, input, num_output=None):
         if not self._alive:
             raise PipeError()
+        self._wait_room(request_size(input))
         val = Future()
-        self._pending.append(input)
         self._producing.append((num_output, val))
-        self._cond.notify()
+        self._enqueue(input)
         return val
 
+    def request_many(self, input, futures):
+        """Sends a buffer of several requests, each sets its own future"""
+        if not self._alive:
+            raise PipeError()
+        self._wait_room(request_size(input))
+        for fut in futures:
+            self._producing.append((None, fut))
+        self._enqueue(input)
+
     def push(self, input):
         """For requests which do not need an answer"""
-        self._pending.append(input)
-        self._cond.notify()
+        self._wait_room(request_size(input))
+        self._enqueue(input)
 
 
 class MuxReqChannel(BaseChannel):
@@ -147,28 +400,34 @@ class MuxReqChannel(BaseChannel):
         for fut in reqs.values():
             fut.throw(PipeError())
 
+    def _outstanding(self):
+        return len(self.requests)
+
+    def _item_size(self, item):
+        return request_size(item[1])
+
     def request(self, input):
         if not self._alive:
             raise PipeError()
+        self._wait_room(request_size(input))
         id = self.new_id()
         assert not id in self.requests
         val = Future()
         self.requests[id] = val
-        self._pending.append((id, input))
-        self._cond.notify()
+        self._enqueue((id, input))
         return val
 
     def push(self, input):
         """For requests which do not need an answer"""
+        self._wait_room(request_size(input))
         id = self.new_id()
         assert not id in self.requests
-        self._pending.append((id, input))
-        self._cond.notify()
+        self._enqueue((id, input))
 
     def produce(self, id, data):
         if not self._alive:
             raise ShutdownException()
         fut = self.requests.pop(id, None)
         if fut is not None:
-            fut.set(data)
+            self._reply(fut, data)
 
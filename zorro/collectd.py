@@ -1,9 +1,19 @@
+import os
 import socket
 import errno
 from time import time as current_time
 
 from .core import gethub, Lock, Future
-from .channel import PipelinedReqChannel
+from . import sleep
+from .channel import PipelinedReqChannel, RecvBuffer
+
+# hub stats which only grow, but are not in ``Hub.counters``, with scale
+TOTALS = {
+    'ctl': 1,
+    'poll_time': 1000000,
+    'run_time': 1000000,
+    }
+SKIPPED_STATS = {'ctl_per_iteration'}
 
 
 class Unix(PipelinedReqChannel):
@@ -36,7 +46,7 @@ class Unix(PipelinedReqChannel):
         if not self._todo:
             res = tuple(self._cur_producing)
             del self._cur_producing[:]
-            self._producing.popleft()[1].set(res)
+            self._produced(res)
 
     def sender(self):
         buf = bytearray()
@@ -51,6 +61,7 @@ class Unix(PipelinedReqChannel):
             wait_write(sock)
             for chunk in self.get_pending_requests():
                 add_chunk(chunk)
+                add_chunk(b'\n')
             try:
                 bytes = sock.send(buf)
             except socket.error as e:
@@ -65,11 +76,10 @@ class Unix(PipelinedReqChannel):
             del buf[:bytes]
 
     def receiver(self):
-        buf = bytearray()
+        buf = RecvBuffer(min_read=self.BUFSIZE)
 
         sock = self._sock
         wait_read = gethub().do_read
-        add_chunk = buf.extend
         pos = 0
         current = []
 
@@ -79,10 +89,8 @@ class Unix(PipelinedReqChannel):
                 pos = 0
             wait_read(sock)
             try:
-                bytes = sock.recv(self.BUFSIZE)
-                if not bytes:
+                if not buf.recv(sock):
                     raise EOFError()
-                add_chunk(bytes)
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
@@ -130,6 +138,8 @@ class Connection(object):
             for val in tup:
                 if val is None:
                     lst.append('U')
+                elif isinstance(val, int):  # derive and counter types
+                    lst.append(str(val))
                 else:
                     lst.append(str(float(val)))
             buf += b' '
@@ -182,5 +192,50 @@ class Connection(object):
             num = int(num)
             yield ident.decode('ascii'), num
 
+    def put_hub_stats(self, hub=None, *, host=None, instance=None,
+        interval=None):
+        """Sends ``Hub.stats()`` of current (or specified) hub
+
+        Counters and running totals are sent with the ``derive`` type
+        (times as integer microseconds) and the rest as ``gauge``, under
+        the ``zorro-<instance>`` plugin. Instance defaults to the pid of
+        the process. ``ctl_per_iteration`` is not sent, as it's an average
+        over the lifetime of the hub, use the rates of ``ctl`` and
+        ``iterations`` instead.
+        """
+        if hub is None:
+            hub = gethub()
+        if host is None:
+            host = socket.gethostname()
+        if instance is None:
+            instance = os.getpid()
+        prefix = '{}/zorro-{}/'.format(host, instance)
+        tm = current_time()
+        futures = []
+        for name, value in sorted(hub.stats().items()):
+            if name in SKIPPED_STATS:
+                continue
+            if name in hub.counters or name in TOTALS:
+                kind = 'derive'
+                value = int(value * TOTALS.get(name, 1))
+            else:
+                kind = 'gauge'
+            futures.append(self.putval_future(
+                '{}{}-{}'.format(prefix, kind, name), [(value,)],
+                interval=interval, time=tm))
+        for f in futures:
+            f.get()
+
     # TODO(tailhook) implement other commands
 
+
+def report_hub_stats(connection, interval=10, **kwargs):
+    """Starts a helper, which sends hub stats every ``interval`` seconds"""
+    hub = gethub()
+    def reporter():
+        while True:
+            sleep(interval)
+            connection.put_hub_stats(hub, interval=max(int(interval), 1),
+                **kwargs)
+    return hub.do_spawnhelper(reporter)
+
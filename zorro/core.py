@@ -1,3 +1,4 @@
+import sys
 import heapq
 import time
 import threading
@@ -5,14 +6,17 @@ import select
 import weakref
 import logging
 import errno
+import traceback
 from collections import deque, defaultdict
 from functools import partial
 from operator import methodcaller
 from math import ceil
+from time import monotonic
 
 import greenlet
 
-from .util import priorityqueue, orderedset, socket_pair, marker_object
+from .util import priorityqueue, timerwheel, orderedset, socket_pair
+from .util import marker_object, histogram
 
 __all__ = [
     'Zorrolet',
@@ -21,6 +25,10 @@ __all__ = [
     'Future',
     'Condition',
     'Lock',
+    'Readable',
+    'Writable',
+    'wait_any',
+    'wait_all',
     ]
 
 FUTURE_EXCEPTION = marker_object('FUTURE_EXCEPTION')
@@ -29,6 +37,10 @@ FUTURE_PENDING = marker_object('FUTURE_PENDING')
 os_errors = (IOError, OSError)
 
 
+def _noref():
+    return None
+
+
 class TimeoutError(Exception):
     pass
 
@@ -70,24 +82,39 @@ class Zorrolet(greenlet.greenlet):
 class EpollWrapper(object):
     delegate_methods = ('register', 'unregister', 'modify', 'close')
 
-    def __init__(self, poll):
+    def __init__(self, poll, maxevents=-1):
         self._poll = poll
+        self.maxevents = maxevents
         for name in self.delegate_methods:
             setattr(self, name, getattr(poll, name))
 
-    def poll(self, timeout=-1, maxevents=-1):
+    def poll(self, timeout=-1):
         if timeout > 0:
-            return self._poll.poll(timeout/1000, maxevents)
+            return self._poll.poll(timeout/1000, self.maxevents)
         else:
-            return self._poll.poll(timeout, maxevents)
+            return self._poll.poll(timeout, self.maxevents)
 
 
-class Hub(object):
+class _Waiters(object):
+    """Greenlets waiting on a file descriptor and its poller registration"""
+    __slots__ = ('read', 'write', 'mask', 'ref')
+
     def __init__(self):
+        self.read = []
+        self.write = []
+        self.mask = 0
+        self.ref = _noref
+
+
+class Hub(object):
+    def __init__(self, *, timer_tick=None, timer_resolution=None,
+        thread_pool_size=8, slow_callback=None, watchdog=None,
+        recycle_greenlets=0, max_events=1024):
         self._log = logging.getLogger('zorro.hub.{:x}'.format(id(self)))
         self._queue = orderedset()
+        self._dequeue = self._queue.discard
         try:
-            self._poller = EpollWrapper(select.epoll())
+            self._poller = EpollWrapper(select.epoll(), max_events)
             self.POLLIN = select.EPOLLIN
             self.POLLOUT = select.EPOLLOUT
             self.POLLHUP = select.EPOLLHUP
@@ -100,16 +127,43 @@ class Hub(object):
             self.POLLERR = select.POLLERR
             self._log.info("Using poller %r", self._poller)
         self._filedes = methodcaller('fileno')
-        self._timeouts = priorityqueue()
-        self._in_sockets = defaultdict(list)
-        self._out_sockets = defaultdict(list)
+        # monotonic time, updated when the hub gets control back
+        self._now = monotonic()
+        self.timer_resolution = timer_resolution
+        if timer_tick is None:
+            self._timeouts = priorityqueue()
+        else:
+            self._timeouts = timerwheel(timer_tick, now=monotonic)
+        # fd -> _Waiters, kept while fd is registered in the poller
+        self._fds = {}
+        self.counters = dict.fromkeys(('iterations', 'polls',
+            'register', 'modify', 'unregister', 'switches', 'timeouts',
+            'wakeups'), 0)
+        self.poll_time = 0.0
+        self.run_time = 0.0
+        self.poll_histogram = histogram()
+        self.run_histogram = histogram()
+        self.fd_wakeups = defaultdict(int)
+        # location -> [count, total time, max time]
+        self.slow_callbacks = {}
+        self.slow_callback = slow_callback
+        self.watchdog = watchdog
+        self._running = None
         self._control = socket_pair()
+        # (fun, args) from other threads, deque is safe without locks
+        self._calls = deque()
+        self._calls_notified = False
+        self._thread_pool = None
+        self.thread_pool_size = thread_pool_size
         self._poller.register(self._control[0], self.POLLIN)
         self._control_fd = self._control[0].fileno()
         self._start_tasks = []
         self._services = weakref.WeakKeyDictionary()
         self._tasks = weakref.WeakKeyDictionary()
         self._helpers = weakref.WeakKeyDictionary()
+        # finished greenlets waiting for a new task, at most this many
+        self.recycle_greenlets = recycle_greenlets
+        self._idle = []
 
     # global methods
 
@@ -125,19 +179,109 @@ class Hub(object):
         self.POLLHUP = POLLHUP
         self.POLLERR = POLLERR
         self._filedes = filedes
-        for k in set(self._in_sockets).union(self._out_sockets):
-            msk = 0
-            if k in self._in_sockets:
-                msk |= POLLIN
-            elif k in self._out_sockets:
-                msk |= POLLOUT
-            self._poller.register(k, msk)
+        for fd, rec in list(self._fds.items()):
+            sock = rec.ref()
+            rec.mask = 0
+            rec.ref = _noref
+            if sock is not None and (rec.read or rec.write):
+                self._check_mask(fd, rec, sock)
+            else:
+                del self._fds[fd]
         if hasattr(self, '_control'):
             self._poller.register(self._control[0], self.POLLIN)
             self._control_fd = self._control[0].fileno()
 
+    def poller_stats(self):
+        """Returns poller syscall counters and their rate per loop iteration
+
+        Only register/modify/unregister are counted as ``ctl`` calls. The
+        hub keeps file descriptors registered between waits, so for sockets
+        which are waited on repeatedly ``ctl_per_iteration`` should be
+        much lower than two.
+        """
+        cnt = self.counters
+        res = dict(cnt)
+        ctl = cnt['register'] + cnt['modify'] + cnt['unregister']
+        res['ctl'] = ctl
+        res['ctl_per_iteration'] = ctl / max(cnt['iterations'], 1)
+        return res
+
+    def now(self):
+        """Current time of monotonic clock, cached by the hub
+
+        The clock is read when the run queue is drained and when the poller
+        returns, so there are no syscalls when many greenlets need time,
+        and the value doesn't jump with wall clock changes.
+        """
+        return self._now
+
+    def deadline(self, timeout):
+        """Converts timeout into a deadline in terms of ``now()``
+
+        With ``timer_resolution`` the deadline is rounded up to the
+        resolution, so timers set at nearly the same time expire together.
+        """
+        targ = self._now + timeout
+        res = self.timer_resolution
+        if res:
+            targ = ceil(targ / res) * res
+        return targ
+
+    def _add_timeout(self, let, timeout):
+        let.cleanup.append(self._timeouts.add(self.deadline(timeout), let))
+
+    def stats(self):
+        """Returns a snapshot of hub statistics as a flat dict
+
+        Counters (``iterations``, ``switches``, ...) only grow, so rate is
+        the difference of two snapshots. Gauges (``queue``, ``tasks``, ...)
+        are current values. Times are in seconds, ``poll_time`` is spent
+        waiting in the poller and ``run_time`` in running greenlets.
+        """
+        res = self.poller_stats()
+        res.update(
+            poll_time=self.poll_time,
+            run_time=self.run_time,
+            queue=len(self._queue),
+            timers=len(self._timeouts),
+            tasks=len(self._tasks),
+            services=len(self._services),
+            helpers=len(self._helpers),
+            )
+        return res
+
+    def histograms(self):
+        """Durations of single poll and of running a queue in one iteration
+
+        Each is a dict of upper bound in seconds to the count, see
+        ``util.histogram``.
+        """
+        return {
+            'poll': self.poll_histogram.snapshot(),
+            'run': self.run_histogram.snapshot(),
+            }
+
+    def slowest(self, num=10):
+        """Returns ``num`` worst offenders of ``slow_callback`` threshold
+
+        Items are ``(location, count, total_time, max_time)`` sorted by total
+        time, location is where greenlet was resumed from.
+        """
+        items = sorted(self.slow_callbacks.items(), key=lambda i: -i[1][1])
+        return [(loc,) + tuple(val) for loc, val in items[:num]]
+
+    def close_after_fork(self):
+        """Closes descriptors of this hub in a forked child process"""
+        if hasattr(self._poller, 'close'):
+            self._poller.close()
+        self._control[0].close()
+        self._control[1].close()
+
     def wakeup(self):
-        self._control[1].send(b'x')
+        try:
+            self._control[1].send(b'x')
+        except BlockingIOError:
+            pass  # control socket is full, so hub is awake anyway
 
     def stop(self):
         """Stop all services, and wait for other tasks to complete"""
@@ -149,6 +293,31 @@ class Hub(object):
         else:
             self.shutdown_tasks(self._services, self._tasks)
 
+    def call_soon_threadsafe(self, fun, *args):
+        """Calls ``fun(*args)`` in the hub's thread, from any other thread
+
+        The function is called by the hub itself (not in a greenlet), so it
+        must not block; use ``do_spawn`` as ``fun`` for longer things. Only
+        the first call after the hub took previous ones writes to the
+        control socket, so lots of calls cost few wakeups.
+        """
+        self._calls.append((fun, args))
+        if not self._calls_notified:
+            self._calls_notified = True
+            self.wakeup()
+
+    def handle_signal(self, signum=None, frame=None):
+        """Signal handler which stops hub gracefully
+
+        Unlike ``stop()`` it's safe to call in the middle of any greenlet,
+        services are stopped by the main loop at next iteration.
+        """
+        self.stopping = True
+        try:
+            self.wakeup()
+        except os_errors:
+            pass  # control socket is full, so hub is awake anyway
+
     def shutdown_tasks(self, src, tgt):
         for i in list(src.keys()):
             del src[i]
@@ -178,7 +347,15 @@ class Hub(object):
         del self._start_tasks
         for f in tasks:
             self.do_spawn(f)
+        if self.watchdog is not None:
+            thread = threading.Thread(target=self._watchdog,
+                name='zorro-watchdog')
+            thread.daemon = True
+            thread.start()
+        counters = self.counters
+        self._now = monotonic()
         while True:
+            counters['iterations'] += 1
             self.queue()
             self.timeouts()
 
@@ -200,6 +377,9 @@ class Hub(object):
         self._log.warning("Hub stopped")
         self.stopping = True
         self.stopped = True
+        del self._idle[:]
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown()
 
     # Logging methods
 
@@ -212,103 +392,253 @@ class Hub(object):
     # Internals
 
     def queue(self):
+        if not self._queue:
+            return
+        switches = 0
+        timed = self.slow_callback is not None or self.watchdog is not None
+        start = self._now
         while not self.stopped:
             tsk = self._queue.first()
             if tsk is None:
-                return
+                break
             t = tsk[0]
             t.detach()
+            switches += 1
+            if timed:
+                where = _location(t)
+                self._running = started = monotonic()
             try:
                 t.switch(*tsk[1:])
             except BaseException as e:
                 self.log_exception(e)
+            if timed:
+                self._running = None
+                spent = monotonic() - started
+                if self.slow_callback is not None and \
+                    spent >= self.slow_callback:
+                    self._slow(t, where, spent)
+            # logged traceback keeps this frame, don't let it keep the task
+            del t, tsk
+        self._now = now = monotonic()
+        spent = now - start
+        self.run_time += spent
+        self.run_histogram.add(spent)
+        self.counters['switches'] += switches
+
+    def _slow(self, let, where, spent):
+        stat = self.slow_callbacks.get(where)
+        if stat is None:
+            stat = self.slow_callbacks[where] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += spent
+        stat[2] = max(stat[2], spent)
+        if let.gr_frame is not None:
+            stack = ''.join(traceback.format_stack(let.gr_frame))
+        else:
+            stack = '  (finished)\n'
+        # log records may be kept, they must not keep the greenlet alive
+        self._log.warning("Greenlet %s blocked the hub for %.3f sec, "
+            "resumed at %s, now at:\n%s", repr(let), spent, where, stack)
+
+    def _watchdog(self):
+        """Logs stack of hub's thread when a greenlet runs for too long
+
+        Catches infinite loops, which never yield back to the hub, so
+        ``slow_callback`` can't report them.
+        """
+        reported = None
+        while not self.stopped:
+            time.sleep(self.watchdog / 4)
+            started = self._running
+            if started is None or started == reported:
+                continue
+            spent = monotonic() - started
+            if spent < self.watchdog:
+                continue
+            reported = started
+            frame = sys._current_frames().get(self._thread)
+            if frame is None:
+                continue
+            self._log.warning("Hub is blocked for %.3f sec in:\n%s",
+                spent, ''.join(traceback.format_stack(frame)))
+            del frame
 
     def io(self):
         timeo = self._timeouts.min()
         if timeo is not None:
-            timeo = int(ceil(max(timeo - time.time(), 0)*1000))
+            timeo = int(ceil(max(timeo - self._now, 0)*1000))
         else:
             timeo = -1
+        self.counters['polls'] += 1
+        start = self._now
         try:
             items = self._poller.poll(timeo)
         except os_errors as e:
+            self._now = monotonic()
             if e.errno in (errno.EINTR, errno.EAGAIN):
                 return
             raise
         else:
+            self._now = now = monotonic()
+            spent = now - start
+            self.poll_time += spent
+            self.poll_histogram.add(spent)
             POLLOUT = self.POLLOUT
             POLLIN = self.POLLIN
             POLLERR = self.POLLHUP | self.POLLERR
+            fd_wakeups = self.fd_wakeups
+            control_fd = self._control_fd
+            get_waiters = self._fds.get
+            queue_task = self.queue_task
             for fd, ev in items:
-                if ev & POLLOUT:
-                    if fd in self._out_sockets:
-                        task = self._out_sockets[fd][0]
-                        self.queue_task(task, 'read')
-                if ev & POLLIN:
-                    if fd in self._in_sockets:
-                        task = self._in_sockets[fd][0]
-                        self.queue_task(task, 'write')
-                    elif fd == self._control_fd:
-                        self._control[0].recv(1024)
-                        # throw it, just need wake up
+                rec = get_waiters(fd)
+                if rec is None:
+                    if fd == control_fd:
+                        self._drain_control()
+                    else:
+                        self._downgrade(fd, POLLIN | POLLOUT)
+                    continue
+                fd_wakeups[fd] += 1
+                read = rec.read
+                write = rec.write
+                if not read and not write:
+                    # nobody waits on this fd any more
+                    self._downgrade(fd, POLLIN | POLLOUT)
+                    continue
                 if ev & POLLERR:
-                    if fd in self._in_sockets:
-                        task = self._in_sockets[fd][0]
-                        self.queue_task(task, 'err')
-                    if fd in self._out_sockets:
-                        task = self._out_sockets[fd][0]
-                        self.queue_task(task, 'err')
-
+                    if read:
+                        queue_task(read[0], 'err')
+                    if write:
+                        queue_task(write[0], 'err')
+                    continue
+                if ev & POLLIN:
+                    if read:
+                        queue_task(read[0], 'write')
+                    else:
+                        self._downgrade(fd, POLLIN)
+                if ev & POLLOUT:
+                    if write:
+                        queue_task(write[0], 'read')
+                    else:
+                        self._downgrade(fd, POLLOUT)
+
+    def _drain_control(self):
+        self.counters['wakeups'] += 1
+        sock = self._control[0]
+        try:
+            while len(sock.recv(4096)) == 4096:
+                pass
+        except os_errors as e:
+            if e.errno not in (errno.EAGAIN, errno.EINTR):
+                raise
+        # the data is thrown away, just needed to wake up
+        self._run_calls()
+
+    def _run_calls(self):
+        # cleared before taking calls, so none of them is left without
+        # a wakeup, at the cost of an occasional spurious one
+        self._calls_notified = False
+        calls = self._calls
+        # calls added while these run wait for the next iteration
+        for i in range(len(calls)):
+            fun, args = calls.popleft()
+            try:
+                fun(*args)
+            except Exception as e:
+                self.log_exception(e)
 
     def timeouts(self):
         if not self._timeouts:
             return
-        now = time.time()
+        now = self._now
         while True:
             task = self._timeouts.pop(now)
             if task is None:
                 break
+            self.counters['timeouts'] += 1
             self.queue_task(task, 'timeout')
 
     def queue_task(self, task, *value):
         task.detach()
-        task.cleanup.append(self._queue.add(task, *value))
+        self._queue.push(task, *value)
+        task.cleanup.append(self._dequeue)
         return task
 
     # Helper methods
     def do_sleep(self, tm, more=False):
-        targ = time.time() + tm
         let = greenlet.getcurrent()
-        let.cleanup.append(self._timeouts.add(targ, let))
+        self._add_timeout(let, tm)
         del let # no cycles
         if not more:
             self._self.switch()
 
-    def _check_mask(self, fd, new=False):
+    def _check_mask(self, fd, rec, sock):
+        """Makes sure poller watches for everything that waiters need
+
+        The mask is never reduced here: file descriptors stay registered
+        when the waiter is woken up, because it will most probably wait on
+        the same socket again. Extra events are dropped lazily in io().
+        """
         msk = 0
-        if fd in self._in_sockets:
+        if rec.read:
             msk |= self.POLLIN
-        if fd in self._out_sockets:
+        if rec.write:
             msk |= self.POLLOUT
-        if new:
+        if rec.ref() is sock:
+            if msk & ~rec.mask:
+                self._poller.modify(fd, msk)
+                self.counters['modify'] += 1
+                rec.mask = msk
+            return
+        # either a new fd, or a closed one which number is reused
+        try:
+            ref = weakref.ref(sock)
+        except TypeError:
+            ref = _noref
+        try:
             self._poller.register(fd, msk)
-        elif msk:
+            self.counters['register'] += 1
+        except os_errors as e:
+            if e.errno != errno.EEXIST:
+                raise
             self._poller.modify(fd, msk)
+            self.counters['modify'] += 1
+        rec.mask = msk
+        rec.ref = ref
+
+    def _downgrade(self, fd, unwanted):
+        rec = self._fds.get(fd)
+        msk = rec.mask & ~unwanted if rec is not None else 0
+        try:
+            if msk:
+                self._poller.modify(fd, msk)
+                self.counters['modify'] += 1
+            else:
+                self._poller.unregister(fd)
+                self.counters['unregister'] += 1
+        except os_errors + (KeyError,):
+            # fd is already closed, so kernel has forgotten it already
+            msk = 0
+        if rec is None:
+            return
+        if msk:
+            rec.mask = msk
+        elif rec.read or rec.write:
+            rec.mask = 0
+            rec.ref = _noref
         else:
-            self._poller.unregister(fd)
+            del self._fds[fd]
 
-    def _queue_sock(self, sock, dic, odic, more=False):
+    def _queue_sock(self, sock, write, more=False):
         fd = self._filedes(sock)
-        def deque_sock(let):
-            items.remove(let)
-            if not items:
-                del dic[fd]
-            self._check_mask(fd)
+        rec = self._fds.get(fd)
+        if rec is None:
+            rec = self._fds[fd] = _Waiters()
+        items = rec.write if write else rec.read
         let = greenlet.getcurrent()
-        let.cleanup.append(deque_sock)
-        items = dic[fd]
+        let.cleanup.append(items.remove)
         items.append(let)
-        self._check_mask(fd, new=len(items) == 1 and fd not in odic)
+        self._check_mask(fd, rec, sock)
         del let
         if not more:
             val = self._self.switch()
@@ -316,10 +646,10 @@ class Hub(object):
                 raise WaitingError()
 
     def do_read(self, sock, more=False):
-        self._queue_sock(sock, self._in_sockets, self._out_sockets, more=more)
+        self._queue_sock(sock, False, more=more)
 
     def do_write(self, sock, more=False):
-        self._queue_sock(sock, self._out_sockets, self._in_sockets, more=more)
+        self._queue_sock(sock, True, more=more)
 
     def do_spawnservice(self, fun):
         if self.stopping:
@@ -329,17 +659,56 @@ class Hub(object):
         self.queue_task(let)
         return let
 
-    def do_spawn(self, fun):
-        let = Zorrolet(fun, self)
+    def _spawn_task(self, fun, recycle):
+        if recycle and self.recycle_greenlets:
+            if self._idle:
+                let = self._idle.pop()
+            else:
+                let = Zorrolet(self._recycled, self)
+            args = (fun,)
+        else:
+            let = Zorrolet(fun, self)
+            args = ()
         self._tasks[let] = None
-        self.queue_task(let)
+        return let, args
+
+    def _recycled(self, fun):
+        """Runs tasks one by one in the same greenlet"""
+        let = greenlet.getcurrent()
+        idle = self._idle
+        while True:
+            try:
+                fun()
+            except greenlet.GreenletExit:
+                self._tasks.pop(let, None)
+                return
+            except BaseException as e:
+                self.log_exception(e)
+            fun = None
+            # timers and waits left by the task must not wake up the next one
+            let.detach()
+            # greenlet is alive, so weakref doesn't remove it
+            self._tasks.pop(let, None)
+            if self.stopping or len(idle) >= self.recycle_greenlets:
+                return
+            idle.append(let)
+            fun = self._self.switch()
+
+    def do_spawn(self, fun, *, recycle=True):
+        """Spawns a task, returns the greenlet which runs it
+
+        When hub has ``recycle_greenlets`` enabled the greenlet is reused
+        for other tasks after this one is finished, so it shouldn't be
+        kept, unless ``recycle=False`` is passed.
+        """
+        let, args = self._spawn_task(fun, recycle)
+        self.queue_task(let, *args)
         return let
 
-    def do_spawnswitch(self, fun):
-        let = Zorrolet(fun, self)
-        self._tasks[let] = None
+    def do_spawnswitch(self, fun, *, recycle=True):
+        let, args = self._spawn_task(fun, recycle)
         self.queue_task(greenlet.getcurrent())
-        let.switch()
+        let.switch(*args)
         return let
 
     def do_spawnhelper(self, fun):
@@ -351,6 +720,25 @@ class Hub(object):
     def add_task(self, fun):
         self._start_tasks.append(fun)
 
+    def run_in_thread(self, fun, *args):
+        """Runs blocking ``fun(*args)`` in a thread pool, returns Future"""
+        pool = self._thread_pool
+        if pool is None:
+            from .threadpool import ThreadPool
+            pool = self._thread_pool = ThreadPool(self,
+                self.thread_pool_size)
+        return pool.submit(fun, *args)
+
+
+def _location(let):
+    frame = let.gr_frame
+    if frame is not None:
+        return '{}:{}'.format(frame.f_code.co_filename, frame.f_lineno)
+    r = getattr(let, 'run', None)
+    if isinstance(r, partial):
+        r = r.func
+    return getattr(r, '__qualname__', repr(r))
+
 
 def gethub():
     let = greenlet.getcurrent()
@@ -365,20 +753,69 @@ class Condition(object):
     def notify(self):
         if self._queue:
             tsk = self._queue[0]
-            tsk.hub.queue_task(tsk)
+            if tsk.__class__ is _Latch:
+                tsk.fire(self)
+            else:
+                tsk.hub.queue_task(tsk, self)
 
-    def wait(self, timeout=None):
-        cur = greenlet.getcurrent()
+    def notify_all(self):
+        # woken up greenlet is removed from the queue immediately
+        while self._queue:
+            self.notify()
+
+    def _listen(self, cur):
         cur.cleanup.append(self._queue.remove)
         self._queue.append(cur)
+        return False
+
+    def wait(self, timeout=None):
+        cur = greenlet.getcurrent()
+        self._listen(cur)
         hub = cur.hub
         if timeout is not None:
-            targ = time.time() + timeout
-            cur.cleanup.append(hub._timeouts.add(targ, cur))
+            hub._add_timeout(cur, timeout)
         del cur # no cycles
         hub._self.switch()
 
 
+class _Latch(object):
+    """Stays in the queue of a ``Condition`` for the whole ``wait_all``
+
+    So notification is remembered even when the greenlet is not waiting
+    at the moment, e.g. it's woken up by another event.
+    """
+    __slots__ = ('cond', 'fired', 'waiter')
+
+    def __init__(self, cond):
+        self.cond = cond
+        self.fired = False
+        self.waiter = None
+        cond._queue.append(self)
+
+    def fire(self, cond):
+        self.cancel()
+        self.fired = True
+        waiter = self.waiter
+        if waiter is not None:
+            waiter.hub.queue_task(waiter, self)
+
+    def cancel(self):
+        try:
+            self.cond._queue.remove(self)
+        except ValueError:
+            pass
+
+    def _listen(self, cur):
+        if self.fired:
+            return True
+        self.waiter = cur
+        cur.cleanup.append(self._unlisten)
+        return False
+
+    def _unlisten(self, cur):
+        self.waiter = None
+
+
 class Future(object):
     def __init__(self, fun=None):
         self._listeners = []
@@ -401,12 +838,10 @@ class Future(object):
             else:
                 return val
         cur = greenlet.getcurrent()
-        cur.cleanup.append(self._listeners.remove)
-        self._listeners.append(cur)
+        self._listen(cur)
         hub = cur.hub
         if timeout is not None:
-            targ = time.time() + timeout
-            cur.cleanup.append(hub._timeouts.add(targ, cur))
+            hub._add_timeout(cur, timeout)
         del cur # no cycles
         hub._self.switch()
         val = self._value
@@ -417,28 +852,141 @@ class Future(object):
         else:
             return val
 
+    def _listen(self, cur):
+        if self._value is not FUTURE_PENDING:
+            return True
+        cur.cleanup.append(self._listeners.remove)
+        self._listeners.append(cur)
+        return False
+
     def set(self, value):
         if self._value is not FUTURE_PENDING:
             raise RuntimeError("Value is already set")
         self._value = value
         lst = self._listeners
         del self._listeners
-        hub = gethub()
-        for one in lst:
-            hub.queue_task(one)
+        # woken up greenlet is removed from the list by the cleanup
+        while lst:
+            one = lst[0]
+            one.hub.queue_task(one, self)
 
     def throw(self, exception):
         self._value = FUTURE_EXCEPTION
         self._exception = exception
         lst = self._listeners
         del self._listeners
-        for one in lst:
-            gethub().queue_task(one)
+        # woken up greenlet is removed from the list by the cleanup
+        while lst:
+            one = lst[0]
+            one.hub.queue_task(one, self)
 
     def check(self):
         return self._value is FUTURE_PENDING
 
 
+class Readable(object):
+    """Socket readiness event for ``wait_any`` and ``wait_all``"""
+    __slots__ = ('sock',)
+    _mask = select.POLLIN | select.POLLHUP | select.POLLERR
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def _listen(self, cur):
+        cur.hub.do_read(self.sock, more=True)
+        return False
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.sock)
+
+
+class Writable(Readable):
+    """Socket readiness event for ``wait_any`` and ``wait_all``"""
+    __slots__ = ()
+    _mask = select.POLLOUT | select.POLLHUP | select.POLLERR
+
+    def _listen(self, cur):
+        cur.hub.do_write(self.sock, more=True)
+        return False
+
+
+def _ready_socket(events):
+    poll = select.poll()
+    socks = {}
+    for ev in events:
+        if isinstance(ev, Readable):
+            fd = ev.sock.fileno()
+            socks.setdefault(fd, []).append(ev)
+            poll.register(fd, ev._mask)
+    for fd, mask in poll.poll(0):
+        for ev in socks[fd]:
+            if mask & ev._mask:
+                return ev
+    return None
+
+
+def wait_any(*events, timeout=None):
+    """Waits until one of the events happens and returns that event
+
+    Events are ``Future`` (done), ``Condition`` (notified), ``Readable``
+    and ``Writable`` (socket is ready, or has an error). Current greenlet is
+    put into the wait lists of all of them, and removed from all when it's
+    woken up. Raises ``TimeoutError`` when nothing happens in ``timeout``.
+    """
+    cur = greenlet.getcurrent()
+    hub = cur.hub
+    ready = None
+    try:
+        for ev in events:
+            if ev._listen(cur):
+                ready = ev
+                break
+        else:
+            if timeout is not None:
+                hub._add_timeout(cur, timeout)
+    except BaseException:
+        cur.detach()
+        raise
+    if ready is not None:
+        cur.detach()
+        return ready
+    del cur # no cycles
+    val = hub._self.switch()
+    if val == 'timeout':
+        raise TimeoutError()
+    for ev in events:
+        if ev is val:
+            return ev
+    ev = _ready_socket(events)
+    if ev is None:
+        raise RuntimeError("Woken up by unknown event {!r}".format(val))
+    return ev
+
+
+def wait_all(*events, timeout=None):
+    """Waits until all the events happen
+
+    ``Condition`` counts if it's notified after ``wait_all`` is called.
+    Raises ``TimeoutError`` if not all of the events happened in
+    ``timeout``.
+    """
+    hub = gethub()
+    if timeout is not None:
+        deadline = hub.now() + timeout
+    left = [_Latch(ev) if isinstance(ev, Condition) else ev for ev in events]
+    try:
+        while left:
+            if timeout is not None:
+                timeout = max(deadline - hub.now(), 0)
+            ev = wait_any(*left, timeout=timeout)
+            left = [e for e in left if e is not ev
+                    and not (e.__class__ is _Latch and e.fired)]
+    finally:
+        for ev in left:
+            if ev.__class__ is _Latch:
+                ev.cancel()
+
+
 class Lock(Condition):
     def __init__(self):
         super().__init__()
@@ -1,8 +1,8 @@
 import socket
 import errno
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
 
-from .core import gethub, Lock
+from .core import gethub, Lock, Condition
 from . import channel
 from .util import setcloexec
 
@@ -50,10 +50,18 @@ class RequestChannel(channel.PipelinedReqChannel):
         self._sock.close()
         super()._close_channel()
 
+    def close(self):
+        """Closes the connection, requests not replied yet fail"""
+        if self._alive:
+            self._alive = False
+            self._stop_producing()
+            self._room.notify_all()
+            self._sock.shutdown(socket.SHUT_RDWR)
+
     def sender(self):
-        buf = bytearray()
+        buf = channel.SendBuffer(self._sock)
 
-        add_chunk = buf.extend
+        add_chunk = buf.add
         wait_write = gethub().do_write
 
         while True:
@@ -65,15 +73,14 @@ class RequestChannel(channel.PipelinedReqChannel):
             for chunk in self.get_pending_requests():
                 add_chunk(chunk)
             try:
-                bytes = self._sock.send(buf)
+                bytes = buf.send()
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
                 else:
                     raise
-            if not bytes:
+            if not bytes and buf:  # nothing to send is fine
                 raise EOFError("Connection closed by peer")
-            del buf[:bytes]
 
     def _readmore(self, buf, pos):
         while True:
@@ -81,10 +88,8 @@ class RequestChannel(channel.PipelinedReqChannel):
                 if pos[0]*2 > len(buf):
                     del buf[:pos[0]]
                     pos[0] = 0
-                bytes = self._sock.recv(self.BUFSIZE)
-                if not bytes:
+                if not buf.recv(self._sock):
                     raise EOFError("Connection closed by peer")
-                buf.extend(bytes)
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     gethub().do_read(self._sock)
@@ -95,7 +100,7 @@ class RequestChannel(channel.PipelinedReqChannel):
                 break
 
     def receiver(self):
-        buf = bytearray()
+        buf = channel.RecvBuffer(min_read=self.BUFSIZE)
 
         sock = self._sock
         pos = [0]
@@ -175,7 +180,7 @@ class RequestChannel(channel.PipelinedReqChannel):
                     while True:
                         self._readmore(buf, pos)
                 except EOFError:
-                     return status, headers, buf
+                     return status, headers, buf[pos[0]:]
 
             clen = int(clen)
             if clen < 0:
@@ -206,9 +211,9 @@ class SecureRequestChannel(RequestChannel):
                 break
 
     def sender(self):
-        buf = bytearray()
+        buf = channel.SendBuffer(self._sock, scatter=False)
 
-        add_chunk = buf.extend
+        add_chunk = buf.add
         wait_write = gethub().do_write
         wait_read = gethub().do_read
 
@@ -220,14 +225,13 @@ class SecureRequestChannel(RequestChannel):
             for chunk in self.get_pending_requests():
                 add_chunk(chunk)
             try:
-                bytes = self._sock.send(buf)
+                bytes = buf.send()
             except ssl.SSLWantReadError:
                 wait_read(self._sock)
             except ssl.SSLWantWriteError:
                 wait_write(self._sock)
-            if not bytes:
+            if not bytes and buf:  # nothing to send is fine
                 raise EOFError("Connection closed by peer")
-            del buf[:bytes]
 
     def _readmore(self, buf, pos):
         while True:
@@ -235,10 +239,8 @@ class SecureRequestChannel(RequestChannel):
                 if pos[0]*2 > len(buf):
                     del buf[:pos[0]]
                     pos[0] = 0
-                bytes = self._sock.recv(self.BUFSIZE)
-                if not bytes:
+                if not buf.recv(self._sock):
                     raise EOFError("Connection closed by peer")
-                buf.extend(bytes)
             except ssl.SSLWantReadError:
                 gethub().do_read(self._sock)
             except ssl.SSLWantWriteError:
@@ -271,32 +273,38 @@ class HTTPClient(object):
             headers={},
             body=None):
         conn = self.connection()
-        assert method.isidentifier(), method
-        assert uri.startswith('/'), uri
-        if query:
-            if '?' in uri:
-                uri += '&' + urlencode(query)
-            else:
-                uri += '?' + urlencode(query)
-        headers = headers.copy()
-        statusline = '{} {} HTTP/1.1'.format(method.upper(), uri)
-        lines = [statusline]
-        if isinstance(body, dict):
-            body = urlencode(body)
-        if isinstance(body, str):
-            body = body.encode('utf-8')  # there are no other encodings, right?
-        if body is not None:
-            clen = len(body)
+        req = encode_request(method, uri, query, headers, body)
+        return self.response_class(*conn.request(req).get())
+
+
+def encode_request(method, uri, query=None, headers={}, body=None):
+    """Returns request as a tuple of buffers for ``RequestChannel``"""
+    assert method.isidentifier(), method
+    assert uri.startswith('/'), uri
+    if query:
+        if '?' in uri:
+            uri += '&' + urlencode(query)
         else:
-            clen = 0
-            body = b''
-        headers['Content-Length'] = clen
-        for k, v in headers.items():
-            lines.append('{}: {}'.format(k, str(v)))
-        lines.append('')
-        lines.append('')
-        buf = '\r\n'.join(lines).encode('ascii')
-        return self.response_class(*conn.request(buf + body).get())
+            uri += '?' + urlencode(query)
+    headers = headers.copy()
+    statusline = '{} {} HTTP/1.1'.format(method.upper(), uri)
+    lines = [statusline]
+    if isinstance(body, dict):
+        body = urlencode(body)
+    if isinstance(body, str):
+        body = body.encode('utf-8')  # there are no other encodings, right?
+    if body is not None:
+        clen = len(body)
+    else:
+        clen = 0
+        body = b''
+    headers['Content-Length'] = clen
+    for k, v in headers.items():
+        lines.append('{}: {}'.format(k, str(v)))
+    lines.append('')
+    lines.append('')
+    buf = '\r\n'.join(lines).encode('ascii')
+    return buf, body
 
 
 class HTTPSClient(HTTPClient):
@@ -316,3 +324,152 @@ class HTTPSClient(HTTPClient):
                     self._channel = SecureRequestChannel(self.host, self.port,
                         unixsock=self.unixsock)
         return self._channel
+
+
+class _Host(object):
+    """Connections of ``HTTPPool`` to a single host"""
+
+    def __init__(self, scheme, host, port):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.channels = []
+        self.used = {}  # channel -> time of the last request
+        self.connecting = 0
+        self.connected = Condition()
+        self.next = 0  # for round robin
+
+
+class HTTPPool(object):
+    """HTTP client for any number of hosts, keeping connections alive
+
+    Connections are kept per ``(scheme, host, port)``, at most
+    ``max_connections`` of each. Request goes to an idle connection if
+    there is one, or to a new connection while the limit allows. Otherwise
+    it's pipelined to one of the busy ones, either the one with the fewest
+    responses pending (``dispatch='least_outstanding'``) or the next one
+    in turn (``dispatch='round_robin'``). Connections which had no requests
+    for ``idle_timeout`` seconds are closed by a helper, which runs while
+    the pool has any connections, closed ones are replaced by new ones on
+    demand.
+    """
+    channel_classes = {
+        'http': RequestChannel,
+        'https': SecureRequestChannel,
+        }
+    default_ports = {
+        'http': 80,
+        'https': 443,
+        }
+
+    def __init__(self, *, max_connections=4, idle_timeout=60,
+        dispatch='least_outstanding', response_class=Response):
+        if dispatch not in ('least_outstanding', 'round_robin'):
+            raise ValueError("Wrong dispatch {!r}".format(dispatch))
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.dispatch = dispatch
+        self.response_class = response_class
+        self._hosts = {}
+        self._reaper = None
+
+    def connection(self, scheme, host, port=None):
+        """Returns connection for next request to the host"""
+        if port is None:
+            port = self.default_ports[scheme]
+        hub = gethub()
+        if self._reaper is None:
+            self._reaper = hub.do_spawnhelper(self._reap_loop)
+        key = scheme, host, port
+        item = self._hosts.get(key)
+        if item is None:
+            item = self._hosts[key] = _Host(scheme, host, port)
+        chans = item.channels
+        while True:
+            if not all(chans):
+                chans[:] = [c for c in chans if c]
+                for chan in list(item.used):
+                    if not chan:
+                        del item.used[chan]
+            for chan in chans:
+                if not chan._outstanding():
+                    break
+            else:
+                if len(chans) + item.connecting < self.max_connections:
+                    chan = self._connect(item)
+                elif not chans:
+                    item.connected.wait()
+                    continue
+                elif self.dispatch == 'round_robin':
+                    item.next = (item.next + 1) % len(chans)
+                    chan = chans[item.next]
+                else:
+                    chan = min(chans, key=RequestChannel._outstanding)
+            break
+        item.used[chan] = hub.now()
+        return chan
+
+    def _connect(self, item):
+        item.connecting += 1
+        try:
+            chan = self.channel_classes[item.scheme](item.host, item.port,
+                unixsock=None)
+        finally:
+            item.connecting -= 1
+            item.connected.notify_all()
+        item.channels.append(chan)
+        return chan
+
+    def _reap_loop(self):
+        try:
+            timeout = self.idle_timeout
+            while self._hosts:
+                gethub().do_sleep(timeout)
+                timeout = self._reap()
+        finally:
+            self._reaper = None
+
+    def _reap(self):
+        """Closes idle connections, returns time until the next check"""
+        now = gethub().now()
+        timeout = self.idle_timeout
+        for key, item in list(self._hosts.items()):
+            for chan, used in list(item.used.items()):
+                if not chan or (now - used >= self.idle_timeout
+                                and not chan._outstanding()):
+                    del item.used[chan]
+                    chan.close()
+                elif used + self.idle_timeout > now:
+                    timeout = min(timeout, used + self.idle_timeout - now)
+            item.channels[:] = [c for c in item.channels if c in item.used]
+            if not item.channels and not item.connecting:
+                del self._hosts[key]
+        return max(timeout, 0.001)
+
+    def request(self, url, *,
+            method='GET',
+            query=None,
+            headers={},
+            body=None):
+        """Makes request to ``url``, like ``'http://example.com/path'``"""
+        parts = urlsplit(url)
+        uri = parts.path or '/'
+        if parts.query:
+            uri += '?' + parts.query
+        conn = self.connection(parts.scheme, parts.hostname, parts.port)
+        if 'Host' not in headers:
+            host = parts.hostname
+            if ':' in host:
+                host = '[' + host + ']'
+            if parts.port and parts.port != self.default_ports[parts.scheme]:
+                host += ':' + str(parts.port)
+            headers = dict(headers, Host=host)
+        req = encode_request(method, uri, query, headers, body)
+        return self.response_class(*conn.request(req).get())
+
+    def close(self):
+        """Closes all connections"""
+        for item in self._hosts.values():
+            for chan in item.channels:
+                chan.close()
+        self._hosts.clear()
@@ -59,11 +59,11 @@ class Channel(channel.MuxReqChannel):
         return self._counter
 
     def sender(self):
-        buf = bytearray()
+        sock = self._sock
+        buf = channel.SendBuffer(sock)
 
-        add_chunk = buf.extend
+        add_chunk = buf.add
         wait_write = gethub().do_write
-        sock = self._sock
 
         while True:
             if not buf:
@@ -73,22 +73,20 @@ class Channel(channel.MuxReqChannel):
                 struct.pack_into('<ii', chunk, 0, len(chunk), id)
                 add_chunk(chunk)
             try:
-                bytes = sock.send(buf)
+                bytes = buf.send()
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
                 else:
                     raise
-            if not bytes:
+            if not bytes and buf:  # nothing to send is fine
                 raise EOFError()
-            del buf[:bytes]
 
     def receiver(self):
-        buf = bytearray()
+        buf = channel.RecvBuffer(min_read=self.BUFSIZE)
 
         sock = self._sock
         wait_read = gethub().do_read
-        add_chunk = buf.extend
         pos = 0
 
         while True:
@@ -97,10 +95,8 @@ class Channel(channel.MuxReqChannel):
                 pos = 0
             wait_read(sock)
             try:
-                bytes = sock.recv(self.BUFSIZE)
-                if not bytes:
+                if not buf.recv(sock):
                     raise EOFError()
-                add_chunk(bytes)
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
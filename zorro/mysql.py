@@ -539,11 +539,11 @@ class Channel(channel.PipelinedReqChannel):
         assert value == OK_PACKET, value
 
     def sender(self):
-        buf = bytearray()
+        sock = self._sock
+        buf = channel.SendBuffer(sock)
 
-        add_chunk = buf.extend
+        add_chunk = buf.add
         wait_write = gethub().do_write
-        sock = self._sock
 
         while True:
             if not buf:
@@ -556,7 +556,7 @@ class Channel(channel.PipelinedReqChannel):
                 chunk[2] = (ln >> 16) & 0xFF
                 add_chunk(chunk)
             try:
-                bytes = sock.send(buf)
+                bytes = buf.send()
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
@@ -564,16 +564,14 @@ class Channel(channel.PipelinedReqChannel):
                     raise EOFError()
                 else:
                     raise
-            if not bytes:
+            if not bytes and buf:  # nothing to send is fine
                 raise EOFError()
-            del buf[:bytes]
 
     def receiver(self):
-        buf = bytearray()
+        buf = channel.RecvBuffer(min_read=self.BUFSIZE)
 
         sock = self._sock
         wait_read = gethub().do_read
-        add_chunk = buf.extend
         pos = 0
         current = []
 
@@ -583,10 +581,8 @@ class Channel(channel.PipelinedReqChannel):
                 pos = 0
             wait_read(sock)
             try:
-                bytes = sock.recv(self.BUFSIZE)
-                if not bytes:
+                if not buf.recv(sock):
                     raise EOFError()
-                add_chunk(bytes)
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
@@ -609,14 +605,14 @@ class Channel(channel.PipelinedReqChannel):
         state = self.__dict__.setdefault('_state', self._producing[0][0])
         if state is HANDSHAKE:
             del self._state
-            self._producing.popleft()[1].set((value,))
+            self._produced((value,))
         elif value[0] == 0xff:
             self._cur_producing.append(value)
             self._do_produce()
         elif state is QUERY:
             if value[0] == 0x00:
                 del self._state
-                self._producing.popleft()[1].set((value,))
+                self._produced((value,))
             else:
                 self._cur_producing.append(value)
                 self._state = QUERY_FIELDS
@@ -656,7 +652,7 @@ class Channel(channel.PipelinedReqChannel):
         res = tuple(self._cur_producing)
         del self._cur_producing[:]
         del self._state
-        self._producing.popleft()[1].set(res)
+        self._produced(res)
 
 
 class Mysql(object):
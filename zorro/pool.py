@@ -18,7 +18,8 @@ class Pool(object):
     def __call__(self, *args, **kw):
         self.current += 1
         cur = getcurrent()
-        killer = gethub().do_spawn(partial(self._timeout, cur))
+        killer = gethub().do_spawn(partial(self._timeout, cur),
+            recycle=False)
         try:
             return self.callback(*args, **kw)
         finally:
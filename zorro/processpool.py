@@ -0,0 +1,395 @@
+"""Pool of forked processes for CPU-bound jobs
+
+Jobs are submitted from greenlets and return Futures. Each worker process
+is connected by a socketpair which is polled by the hub like any other
+socket, so no threads are involved.
+
+Large bytes-like arguments and results (the ``shm_threshold`` and bigger)
+are not pickled through the socket. They are copied into a shared memory
+segment by the sender and out of it by the receiver, and only the name of
+the segment is sent. This works for top-level arguments and results, and
+for items of a tuple or list result. Segments are unlinked by the parent,
+including ones of jobs which failed because the worker died.
+
+Functions and other arguments must be picklable, as usual.
+
+Usage::
+
+    pool = ProcessPool(4)
+
+    def handler(data):
+        return pool.call(bson_decode, data)
+"""
+import os
+import errno
+import signal
+import pickle
+import struct
+import socket
+import logging
+from itertools import count
+from collections import deque
+
+from .core import gethub
+from . import channel, sleep
+from .util import setcloexec, socket_pair
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+log = logging.getLogger(__name__)
+
+FRAME = struct.Struct('<L')
+SHM_DIR = '/dev/shm'
+
+
+class SharedBlock(object):
+    """Replaces a large buffer in a message, refers to a shared memory"""
+    __slots__ = ('name', 'size', 'kind')
+
+    def __init__(self, name, size, kind):
+        self.name = name
+        self.size = size
+        self.kind = kind
+
+    def __reduce__(self):
+        return SharedBlock, (self.name, self.size, self.kind)
+
+
+def _result_prefix(pid):
+    return 'zorro-{:d}-'.format(pid)
+
+
+def _unlink(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _unlink_results(pid):
+    """Removes result segments of the worker which will never be read"""
+    if shared_memory is None or not os.path.isdir(SHM_DIR):
+        return
+    prefix = _result_prefix(pid)
+    for name in os.listdir(SHM_DIR):
+        if name.startswith(prefix):
+            _unlink(name)
+
+
+def _share(value, threshold, segments, names=None):
+    if shared_memory is None or not isinstance(value,
+        (bytes, bytearray, memoryview)):
+        return value
+    size = memoryview(value).nbytes
+    if size < threshold:
+        return value
+    if names is None:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+    else:
+        name = next(names)
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:  # left by a dead process with same pid
+            _unlink(name)
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+    segments.append(shm.name)
+    try:
+        shm.buf[:size] = memoryview(value).cast('B')
+    finally:
+        shm.close()
+    return SharedBlock(shm.name, size,
+        bytearray if isinstance(value, bytearray) else bytes)
+
+
+def _unshare(value, unlink=True):
+    if not isinstance(value, SharedBlock):
+        return value
+    shm = shared_memory.SharedMemory(name=value.name)
+    try:
+        return value.kind(shm.buf[:value.size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _share_items(seq, threshold, segments, names=None):
+    return type(seq)(_share(v, threshold, segments, names) for v in seq)
+
+
+def _unshare_items(seq, unlink=True):
+    return type(seq)(_unshare(v, unlink) for v in seq)
+
+
+def _frame(obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    return FRAME.pack(len(data)) + data
+
+
+def dump_job(fun, args, kwargs, threshold, segments):
+    """Pickles a job, names of created segments are added to ``segments``"""
+    try:
+        return _frame((fun, _share_items(args, threshold, segments),
+            {k: _share(v, threshold, segments) for k, v in kwargs.items()}))
+    except BaseException:
+        for name in segments:
+            _unlink(name)
+        raise
+
+
+def load_job(data):
+    # segments of arguments are unlinked by the parent, when job is done
+    fun, args, kwargs = pickle.loads(data)
+    return (fun, _unshare_items(args, unlink=False),
+        {k: _unshare(v, unlink=False) for k, v in kwargs.items()})
+
+
+def dump_result(ok, value, threshold, segments, names):
+    try:
+        if isinstance(value, (tuple, list)) and type(value) in (tuple, list):
+            return _frame((ok, 'items',
+                _share_items(value, threshold, segments, names)))
+        return _frame((ok, 'value', _share(value, threshold, segments, names)))
+    except BaseException:
+        for name in segments:
+            _unlink(name)
+        raise
+
+
+def load_result(data):
+    ok, kind, value = pickle.loads(data)
+    if kind == 'items':
+        return ok, _unshare_items(value)
+    return ok, _unshare(value)
+
+
+class WorkerChannel(channel.PipelinedReqChannel):
+    BUFSIZE = 65536
+
+    def __init__(self, pool):
+        super().__init__()
+        self._sock, child = socket_pair()
+        setcloexec(self._sock)
+        self.pid = os.fork()
+        if not self.pid:
+            code = 1
+            try:
+                self._sock.close()
+                # other workers must see EOF when parent closes the socket
+                for chan in pool._channels:
+                    chan._sock.close()
+                gethub().close_after_fork()
+                child.setblocking(1)
+                _worker_loop(child, pool.shm_threshold)
+                code = 0
+            except BaseException:
+                log.exception("Process pool worker crashed")
+            finally:
+                os._exit(code)
+        child.close()
+        self._segments = deque()  # shared memory of each job sent
+        self._start()
+
+    def _close_channel(self):
+        self._sock.close()
+        # nothing is read any more, worker cleans up ones not sent
+        _unlink_results(self.pid)
+        super()._close_channel()
+
+    def _stop_producing(self):
+        for segments in self._segments:
+            for name in segments:
+                _unlink(name)
+        self._segments.clear()
+        super()._stop_producing()
+
+    def request(self, input, segments=()):
+        fut = super().request(input)
+        self._segments.append(segments)
+        return fut
+
+    def close(self):
+        """Closes the connection, jobs not done yet fail with PipeError"""
+        if self._alive:
+            self._alive = False
+            self._stop_producing()
+            self._room.notify_all()
+            self._sock.shutdown(socket.SHUT_RDWR)
+
+    def produce(self, value):
+        if not self._alive:
+            raise channel.ShutdownException()
+        ok, value = value
+        for name in self._segments.popleft():
+            _unlink(name)
+        if ok:
+            self._produced(value)
+        else:
+            self._produced(None, value)
+
+    def sender(self):
+        buf = bytearray()
+
+        add_chunk = buf.extend
+        wait_write = gethub().do_write
+
+        while True:
+            if not buf:
+                self.wait_requests()
+            if not self._alive:
+                return
+            wait_write(self._sock)
+            for chunk in self.get_pending_requests():
+                add_chunk(chunk)
+            try:
+                bytes = self._sock.send(buf)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                else:
+                    raise
+            if not bytes:
+                raise EOFError()
+            del buf[:bytes]
+
+    def receiver(self):
+        buf = channel.RecvBuffer(min_read=self.BUFSIZE)
+
+        sock = self._sock
+        wait_read = gethub().do_read
+        pos = 0
+
+        while True:
+            if pos*2 > len(buf):
+                del buf[:pos]
+                pos = 0
+            wait_read(sock)
+            try:
+                if not buf.recv(sock):
+                    raise EOFError()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                else:
+                    raise
+            while len(buf) - pos >= FRAME.size:
+                ln, = FRAME.unpack_from(buf, pos)
+                if len(buf) - pos - FRAME.size < ln:
+                    break
+                pos += FRAME.size
+                self.produce(load_result(buf[pos:pos+ln]))
+                pos += ln
+
+
+def _recvall(sock, ln):
+    buf = bytearray(ln)
+    view = memoryview(buf)
+    while view:
+        bytes = sock.recv_into(view)
+        if not bytes:
+            raise EOFError()
+        view = view[bytes:]
+    return buf
+
+
+def _worker_loop(sock, threshold):
+    names = ('{}{:d}'.format(_result_prefix(os.getpid()), i)
+             for i in count())
+    while True:
+        try:
+            ln, = FRAME.unpack(_recvall(sock, FRAME.size))
+        except EOFError:
+            return
+        fun, args, kwargs = load_job(_recvall(sock, ln))
+        try:
+            ok, result = True, fun(*args, **kwargs)
+        except Exception as e:
+            ok, result = False, e
+        del fun, args, kwargs
+        segments = []
+        try:
+            data = dump_result(ok, result, threshold, segments, names)
+        except Exception as e:
+            segments = []
+            data = dump_result(False, RuntimeError(
+                "Can't pickle result: {!r}".format(e)), threshold,
+                segments, names)
+        del result
+        try:
+            sock.sendall(data)
+        except BaseException as e:
+            for name in segments:
+                _unlink(name)
+            if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                return  # pool is closed
+            raise
+
+
+class ProcessPool(object):
+    """Pool of ``size`` worker processes, forked on first use"""
+
+    def __init__(self, size=None, *, shm_threshold=65536):
+        self.size = size or os.cpu_count() or 1
+        self.shm_threshold = shm_threshold
+        self._channels = []
+        self._pids = set()
+
+    def _channel(self):
+        chans = self._channels
+        if len(chans) < self.size or not all(chans):
+            chans[:] = [c for c in chans if c]
+            self._reap()
+            while len(chans) < self.size:
+                chan = WorkerChannel(self)
+                self._pids.add(chan.pid)
+                chans.append(chan)
+        return min(chans, key=lambda c: len(c._producing))
+
+    def _reap(self):
+        for pid in list(self._pids):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = True
+            if done:
+                self._pids.discard(pid)
+                _unlink_results(pid)
+
+    def submit(self, fun, *args, **kwargs):
+        """Runs ``fun(*args, **kwargs)`` in a worker, returns a Future"""
+        segments = []
+        msg = dump_job(fun, args, kwargs, self.shm_threshold, segments)
+        try:
+            return self._channel().request(msg, segments)
+        except BaseException:
+            for name in segments:
+                _unlink(name)
+            raise
+
+    def call(self, fun, *args, **kwargs):
+        return self.submit(fun, *args, **kwargs).get()
+
+    def close(self, timeout=5):
+        """Stops workers, pending jobs fail with PipeError
+
+        Workers exit after they finish current job, ones that are not done
+        in ``timeout`` seconds are killed
+        """
+        for chan in self._channels:
+            chan.close()
+        del self._channels[:]
+        while self._pids and timeout > 0:
+            sleep(0.01)
+            timeout -= 0.01
+            self._reap()
+        for pid in self._pids:
+            os.kill(pid, signal.SIGKILL)
+        while self._pids:
+            sleep(0.01)
+            self._reap()
@@ -1,11 +1,19 @@
 import socket
 import errno
+import logging
+from bisect import bisect_left
+from hashlib import md5, sha1
+from functools import partial
+from collections import OrderedDict, deque
 
-from .core import gethub, Lock
-from . import channel
+from .core import gethub, Lock, Future, Condition
+from . import channel, sleep
 from .util import setcloexec
 
 
+log = logging.getLogger(__name__)
+
+
 convert = {
     str: lambda a: a.encode('utf-8'),
     bytes: lambda a: a,
@@ -13,46 +21,214 @@ convert = {
     int: lambda a: bytes(str(a), 'utf-8'),
     float: lambda a: bytes(repr(a), 'utf-8'),
     }
+LARGE_VALUE = 65536
+
+
+# headers of arrays and bulk strings of small lengths
+_ARRAY_HEADERS = tuple('*{:d}\r\n'.format(i).encode('ascii')
+                       for i in range(32))
+_BULK_HEADERS = tuple('${:d}\r\n'.format(i).encode('ascii')
+                      for i in range(1024))
+# command name to its encoded form, like b'$3\r\nGET\r\n'
+_command_cache = {}
+COMMAND_CACHE_SIZE = 1024
+
+
+def _encode_name(name):
+    value = convert[name.__class__](name)
+    res = '${:d}\r\n'.format(len(value)).encode('ascii') + value + b'\r\n'
+    if name.__class__ in (str, bytes) and \
+        len(_command_cache) < COMMAND_CACHE_SIZE:
+        _command_cache[name] = res
+    return res
 
 
-def encode_command(buf, parts):
+def encode_command(buf, parts, chunks=None):
+    """Appends a command to ``buf``, returns the buffer to continue with
+
+    When ``chunks`` list is given, ``bytes`` values of ``LARGE_VALUE`` and
+    bigger are not copied: ``buf`` and the value are appended to ``chunks``
+    and a new buffer is returned.
+    """
     add = buf.extend
-    cvt = convert
-    add('*{:d}\r\n'.format(len(parts)).encode('ascii'))
-    for part in parts:
-        value = cvt[part.__class__](part)
-        add('${:d}\r\n'.format(len(value)).encode("ascii"))
+    num = len(parts)
+    if num < 32:
+        add(_ARRAY_HEADERS[num])
+    else:
+        add('*{:d}\r\n'.format(num).encode('ascii'))
+    if not num:
+        return buf
+    name = parts[0]
+    try:
+        add(_command_cache[name])
+    except (KeyError, TypeError):
+        add(_encode_name(name))
+    bulk_headers = _BULK_HEADERS
+    for i in range(1, num):
+        value = parts[i]
+        cls = value.__class__
+        if cls is str:
+            value = value.encode('utf-8')
+        elif cls is not bytes:
+            value = convert[cls](value)
+        ln = len(value)
+        if ln < 1024:
+            add(bulk_headers[ln])
+        else:
+            add('${:d}\r\n'.format(ln).encode('ascii'))
+            if chunks is not None and ln >= LARGE_VALUE \
+                and value.__class__ is bytes:
+                chunks.append(buf)
+                chunks.append(value)
+                buf = bytearray(b'\r\n')
+                add = buf.extend
+                continue
         add(value)
         add(b'\r\n')
     return buf
 
 
+def encode_commands(commands):
+    """Encodes commands to a buffer or a list of them for ``request()``"""
+    chunks = []
+    buf = bytearray()
+    for cmd in commands:
+        buf = encode_command(buf, cmd, chunks)
+    if chunks:
+        chunks.append(buf)
+        return chunks
+    return buf
+
+
 class RedisError(Exception):
     pass
 
 
+class ReplyParser(object):
+    """Incremental parser of redis replies
+
+    ``parse()`` calls ``produce`` for every complete reply in the buffer
+    and returns the position of the first byte which is not parsed yet.
+    Arrays are parsed without recursion, and their elements which are
+    already parsed are kept between calls, so a long reply is scanned only
+    once, however many reads it takes.
+    """
+
+    def __init__(self):
+        self.stack = []  # [items, number left] for each unfinished array
+
+    def parse(self, buf, pos, produce):
+        stack = self.stack
+        find = buf.find
+        end = len(buf)
+        while pos < end:
+            idx = find(b'\r\n', pos+1)
+            if idx < 0:
+                break
+            ch = buf[pos]
+            if ch == 36 and stack:
+                # fast path for elements of arrays, mostly bulk strings
+                top = stack[-1]
+                items = top[0]
+                add = items.append
+                left = top[1]
+                while True:
+                    ln = int(buf[pos+1:idx])
+                    if ln < 0:
+                        add(None)
+                        pos = idx + 2
+                    else:
+                        start = idx + 2
+                        stop = start + ln
+                        if stop + 2 > end:
+                            break
+                        if buf[stop] != 13 or buf[stop+1] != 10:
+                            raise RedisError("Bulk string is not terminated")
+                        add(buf[start:stop])
+                        pos = stop + 2
+                    left -= 1
+                    if not left or pos >= end or buf[pos] != 36:
+                        break
+                    idx = find(b'\r\n', pos+1)
+                    if idx < 0:
+                        break
+                top[1] = left
+                if left:
+                    if pos < end and buf[pos] != 36:
+                        continue
+                    break
+                value = stack.pop()[0]
+            elif ch == 36: # b'$'
+                ln = int(buf[pos+1:idx])
+                if ln < 0:
+                    value = None
+                    pos = idx + 2
+                else:
+                    start = idx + 2
+                    stop = start + ln
+                    if stop + 2 > end:
+                        break
+                    if buf[stop] != 13 or buf[stop+1] != 10:
+                        raise RedisError("Bulk string is not terminated")
+                    value = buf[start:stop]
+                    pos = stop + 2
+            elif ch == 42: # b'*'
+                cnt = int(buf[pos+1:idx])
+                pos = idx + 2
+                if cnt > 0:
+                    stack.append([[], cnt])
+                    continue
+                value = []
+            elif ch == 58: # b':'
+                value = int(buf[pos+1:idx])
+                pos = idx + 2
+            elif ch == 43: # b'+'
+                value = buf[pos+1:idx].decode('ascii')
+                pos = idx + 2
+            elif ch == 45: # b'-'
+                value = RedisError(buf[pos+1:idx].decode('ascii'))
+                pos = idx + 2
+            else:
+                raise NotImplementedError(ch)
+            while stack:
+                top = stack[-1]
+                top[0].append(value)
+                top[1] -= 1
+                if top[1]:
+                    break
+                value = stack.pop()[0]
+            else:
+                produce(value)
+        return pos
+
+
+def connect(host, port, unixsock):
+    if unixsock:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET,
+            socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    setcloexec(sock)
+    sock.setblocking(0)
+    try:
+        if unixsock:
+            sock.connect(unixsock)
+        else:
+            sock.connect((host, port))
+    except socket.error as e:
+        if e.errno == errno.EINPROGRESS:
+            gethub().do_write(sock)
+        else:
+            raise
+    return sock
+
+
 class RedisChannel(channel.PipelinedReqChannel):
     BUFSIZE = 16384
 
     def __init__(self, host, port, unixsock, db):
         super().__init__()
-        if unixsock:
-            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        else:
-            self._sock = socket.socket(socket.AF_INET,
-                socket.SOCK_STREAM, socket.IPPROTO_TCP)
-        setcloexec(self._sock)
-        self._sock.setblocking(0)
-        try:
-            if unixsock:
-                self._sock.connect(unixsock)
-            else:
-                self._sock.connect((host, port))
-        except socket.error as e:
-            if e.errno == errno.EINPROGRESS:
-                gethub().do_write(self._sock)
-            else:
-                raise
+        self._sock = connect(host, port, unixsock)
         self._start()
         db = str(db)
         assert self.request('*2\r\n$6\r\nSELECT\r\n${0}\r\n{1}\r\n'
@@ -63,9 +239,9 @@ class RedisChannel(channel.PipelinedReqChannel):
         super()._close_channel()
 
     def sender(self):
-        buf = bytearray()
+        buf = channel.SendBuffer(self._sock)
 
-        add_chunk = buf.extend
+        add_chunk = buf.add
         wait_write = gethub().do_write
 
         while True:
@@ -77,141 +253,352 @@ class RedisChannel(channel.PipelinedReqChannel):
             for chunk in self.get_pending_requests():
                 add_chunk(chunk)
             try:
-                bytes = self._sock.send(buf)
+                bytes = buf.send()
             except socket.error as e:
                 if e.errno in (errno.EAGAIN, errno.EINTR):
                     continue
                 else:
                     raise
-            if not bytes:
+            if not bytes and buf:  # nothing to send is fine
                 raise EOFError()
-            del buf[:bytes]
 
     def receiver(self):
-        buf = bytearray()
+        buf = channel.RecvBuffer(min_read=self.BUFSIZE)
 
         sock = self._sock
         wait_read = gethub().do_read
-        add_chunk = buf.extend
-        pos = [0]
+        parse = ReplyParser().parse
+        produce = self.produce
+        pos = 0
 
-        def readmore():
-            while True:
-                wait_read(sock)
-                try:
-                    if pos[0]*2 > len(buf):
-                        del buf[:pos[0]]
-                        pos[0] = 0
-                    bytes = sock.recv(self.BUFSIZE)
-                    if not bytes:
-                        raise EOFError()
-                    add_chunk(bytes)
-                except socket.error as e:
-                    if e.errno in (errno.EAGAIN, errno.EINTR):
-                        continue
-                    else:
-                        raise
+        while True:
+            if pos*2 > len(buf):
+                del buf[:pos]
+                pos = 0
+            wait_read(sock)
+            try:
+                if not buf.recv(sock):
+                    raise EOFError()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
                 else:
-                    break
+                    raise
+            pos = parse(buf, pos, produce)
 
-        def readchar():
-            if len(buf) <= pos[0]:
-                readmore()
-            c = buf[pos[0]]
-            pos[0] += 1
-            return c
 
-        def readline():
-            if len(buf) < 2 or pos[0] >= len(buf):
-                readmore()
-            while True:
+class SubscriberChannel(channel.BaseChannel):
+    """Connection in pub/sub mode, every reply is passed to ``dispatch``"""
+    BUFSIZE = 16384
+
+    def __init__(self, sock, dispatch, on_close):
+        super().__init__()
+        self._sock = sock
+        self._dispatch = dispatch
+        self._on_close = on_close
+        self._start()
+
+    def _close_channel(self):
+        self._sock.close()
+        super()._close_channel()
+        self._on_close(self)
+
+    def _stop_producing(self):
+        self._cond.notify()  # wake up sender to let it exit
+
+    def push(self, commands):
+        self._wait_room(0)
+        self._enqueue(encode_commands(commands))
+
+    def produce(self, value):
+        if not self._alive:
+            raise channel.ShutdownException()
+        self._dispatch(value)
+
+    sender = RedisChannel.sender
+    receiver = RedisChannel.receiver
+
+
+class Subscriber(object):
+    """Dedicated connection which receives pub/sub messages
+
+    Each message is processed by ``callback(channel, message)`` in a new
+    greenlet, like in ``zmq.sub_socket``. If the callback has a
+    ``wait_slot`` method (e.g. ``pool.Pool``), it's called before reading
+    next message. For pattern subscriptions ``channel`` is the name of the
+    channel which matched the pattern.
+
+    Subscriptions are restored when the connection is reestablished.
+    """
+    reconnect_interval = 1
+    batch_size = 1000  # channels per SUBSCRIBE command
+
+    def __init__(self, host='localhost', port=6379, unixsock=None):
+        self.host = host
+        self.port = port
+        self.unixsock = unixsock
+        self._channels = {}
+        self._patterns = {}
+        self._confirmed = set()  # (kind, name) confirmed by the server
+        self._channel = None
+        self._channel_lock = Lock()
+        self._reconnecting = False
+        self._closed = False
+
+    def _connection(self):
+        if not self._channel:
+            with self._channel_lock:
+                if not self._channel:
+                    chan = SubscriberChannel(connect(self.host, self.port,
+                        self.unixsock), self._message, self._disconnected)
+                    self._confirmed = set()
+                    self._send(chan, 'SUBSCRIBE', list(self._channels))
+                    self._send(chan, 'PSUBSCRIBE', list(self._patterns))
+                    self._channel = chan
+        return self._channel
+
+    def _send(self, chan, command, names):
+        if not names:
+            return  # bare command would unsubscribe from everything
+        step = self.batch_size
+        chan.push([(command,) + tuple(names[i:i+step])
+                   for i in range(0, len(names), step)])
+
+    def _disconnected(self, chan):
+        if self._closed or self._reconnecting or chan is not self._channel:
+            return
+        if self._channels or self._patterns:
+            self._reconnecting = True
+            gethub().do_spawnhelper(self._reconnect)
+
+    def _reconnect(self):
+        try:
+            while not self._closed:
                 try:
-                    idx = buf.index(b'\r\n', pos[0])
-                except ValueError:
-                    pass
+                    self._connection()
+                except Exception as e:
+                    log.warning("Can't connect to redis: %r", e)
+                    sleep(self.reconnect_interval)
                 else:
                     break
-                readmore()
-            res = buf[pos[0]:idx]
-            pos[0] = idx + 2
-            return res
+        finally:
+            self._reconnecting = False
 
-        def readslice(ln):
-            while len(buf) - pos[0] < ln:
-                readmore()
-            res = buf[pos[0]:pos[0]+ln]
-            pos[0] += ln
-            return res
+    def _register(self, target, command, callback, names):
+        names = [bytes(convert[n.__class__](n)) for n in names]
+        for name in names:
+            target[name] = callback
+        if self._channel:
+            self._send(self._channel, command, names)
+        else:
+            self._closed = False
+            self._connection()  # subscribes to everything registered
 
-        def readone():
-            ch = readchar()
-            if ch == 42: # b'*'
-                cnt = int(readline())
-                return [readone() for i in range(cnt)]
-            elif ch == 43: # b'+'
-                return readline().decode('ascii')
-            elif ch == 45: # b'-'
-                return RedisError(readline().decode('ascii'))
-            elif ch == 58: # b':'
-                return int(readline())
-            elif ch == 36: # b'$'
-                ln = int(readline())
-                if ln < 0:
-                    return None
-                res = readslice(ln)
-                assert readline() == b''
-                return res
-            else:
-                raise NotImplementedError(ch)
+    def _unregister(self, target, command, names):
+        if not names:
+            target.clear()
+            if self._channel:
+                self._channel.push([(command,)])
+            return
+        names = [bytes(convert[n.__class__](n)) for n in names]
+        for name in names:
+            target.pop(name, None)
+        if self._channel:
+            self._send(self._channel, command, names)
 
-        while True:
-            self.produce(readone())
+    def subscribed(self, name, *, pattern=False):
+        """Whether the server confirmed subscription on current connection
+
+        Messages published before the confirmation are not received.
+        """
+        kind = b'psubscribe' if pattern else b'subscribe'
+        return (kind, bytes(convert[name.__class__](name))) in self._confirmed
+
+    def subscribe(self, callback, *channels):
+        self._register(self._channels, 'SUBSCRIBE', callback, channels)
+
+    def psubscribe(self, callback, *patterns):
+        self._register(self._patterns, 'PSUBSCRIBE', callback, patterns)
+
+    def unsubscribe(self, *channels):
+        """Unsubscribes from ``channels``, or from all without arguments"""
+        self._unregister(self._channels, 'UNSUBSCRIBE', channels)
+
+    def punsubscribe(self, *patterns):
+        """Unsubscribes from ``patterns``, or from all without arguments"""
+        self._unregister(self._patterns, 'PUNSUBSCRIBE', patterns)
+
+    def close(self):
+        """Drops all subscriptions and closes the connection"""
+        self._closed = True
+        self._channels.clear()
+        self._patterns.clear()
+        if self._channel:
+            self._channel._sock.shutdown(socket.SHUT_RDWR)
+
+    def _message(self, value):
+        if isinstance(value, RedisError):
+            log.error("Error in subscriber: %s", value)
+            return
+        kind = value[0]
+        if kind == b'message':
+            callback = self._channels.get(bytes(value[1]))
+            args = bytes(value[1]), value[2]
+        elif kind == b'pmessage':
+            callback = self._patterns.get(bytes(value[1]))
+            args = bytes(value[2]), value[3]
+        elif kind in (b'subscribe', b'psubscribe'):
+            self._confirmed.add((bytes(kind), bytes(value[1])))
+            return
+        else:
+            if value[1] is None:
+                return  # unsubscribed from all, when there was nothing
+            kind = b'psubscribe' if kind == b'punsubscribe' else b'subscribe'
+            self._confirmed.discard((kind, bytes(value[1])))
+            return
+        if callback is None:
+            return  # unsubscribed, but the message was already sent
+        wait_slot = getattr(callback, 'wait_slot', None)
+        if wait_slot is not None:
+            wait_slot()
+        gethub().do_spawnswitch(partial(callback, *args))
 
 
 class Redis(object):
-    def __init__(self, host='localhost', port=6379, unixsock=None, db=0):
+    """Redis client, which pipelines requests of all greenlets
+
+    With ``pool_size`` greater than one, several connections are kept and
+    each request is sent to the one with fewest replies pending, so a slow
+    command doesn't delay replies to everyone. Consecutive commands may go
+    to different connections then, so ``WATCH`` and other connection state
+    can only be used inside a single ``bulk()`` or ``pipeline()``.
+
+    Connections which are closed are reopened in background, while
+    requests go to the other ones. Only when there are no connections at
+    all, the request waits for the connection.
+
+    With ``batch_size`` set, commands of ``execute()`` and ``future()``
+    issued by all greenlets in the same iteration of the hub loop are
+    sent as a single write, at most ``batch_size`` commands each.
+    """
+    reconnect_interval = 1
+
+    def __init__(self, host='localhost', port=6379, unixsock=None, db=0,
+        pool_size=1, batch_size=None):
         self.unixsock = unixsock
         self.host = host
         self.port = port
         self.db = db
-        self._channel = None
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self._batch = None
+        self._batches = []  # not sent yet, in order
+        self._channels = []
+        self._connecting = 0
+        self._retry_at = None
         self._channel_lock = Lock()
 
+    def _connect(self):
+        return RedisChannel(self.host, self.port,
+            db=self.db, unixsock=self.unixsock)
+
+    def _reconnect(self):
+        try:
+            chan = self._connect()
+        except Exception as e:
+            log.warning("Can't connect to redis: %r", e)
+            self._retry_at = gethub().deadline(self.reconnect_interval)
+        else:
+            self._channels.append(chan)
+        finally:
+            self._connecting -= 1
+
+    def _grow(self):
+        if self._retry_at is not None:
+            if gethub().now() < self._retry_at:
+                return
+            self._retry_at = None
+        for i in range(self.pool_size - len(self._channels)
+                       - self._connecting):
+            self._connecting += 1
+            gethub().do_spawnhelper(self._reconnect)
+
     def check_connection(self):
-        if not self._channel:
-            with self._channel_lock:
-                if not self._channel:
-                    self._channel = RedisChannel(self.host, self.port,
-                        db=self.db, unixsock=self.unixsock)
+        """Returns the least loaded connection, connects if there is none"""
+        chans = self._channels
+        if len(chans) < self.pool_size or not all(chans):
+            chans[:] = [c for c in chans if c]
+            if not chans:
+                with self._channel_lock:
+                    if not chans:
+                        chans.append(self._connect())
+            self._grow()
+        if len(chans) == 1:
+            return chans[0]
+        return min(chans, key=RedisChannel._outstanding)
+
+    def _batched(self, args):
+        fut = Future()
+        batch = self._batch
+        if batch is None:
+            batch = self._batch = []
+            self._batches.append(batch)
+            gethub().do_spawn(self._send_batches)
+        batch.append((args, fut))
+        if len(batch) >= self.batch_size:
+            self._batch = None  # next command starts a new batch
+        return fut
+
+    def _send_batches(self):
+        batches = self._batches
+        if not batches:
+            return  # already sent by pipeline() or bulk()
+        self._batches = []
+        self._batch = None
+        try:
+            chan = self.check_connection()
+        except Exception as e:
+            for batch in batches:
+                for args, fut in batch:
+                    fut.throw(e)
+            return
+        for batch in batches:
+            futures = [fut for args, fut in batch]
+            try:
+                chan.request_many(
+                    encode_commands([args for args, fut in batch]), futures)
+            except Exception as e:
+                for fut in futures:
+                    fut.throw(e)
 
     # low-level stuff
     def execute(self, *args):
-        self.check_connection()
-        buf = bytearray()
-        encode_command(buf, args)
-        return self._channel.request(buf).get()
+        if self.batch_size:
+            return self._batched(args).get()
+        chan = self.check_connection()
+        return chan.request(encode_commands((args,))).get()
 
     def future(self, *args):
-        self.check_connection()
-        buf = bytearray()
-        encode_command(buf, args)
-        return self._channel.request(buf)
+        if self.batch_size:
+            return self._batched(args)
+        chan = self.check_connection()
+        return chan.request(encode_commands((args,)))
 
     def pipeline(self, commands):
-        self.check_connection()
-        buf = bytearray()
-        for cmd in commands:
-            encode_command(buf, cmd)
-        return self._channel.request(buf, len(commands)).get()
+        if self._batches:
+            self._send_batches()  # keep order of commands
+        chan = self.check_connection()
+        buf = encode_commands(commands)
+        return chan.request(buf, len(commands)).get()
 
     def bulk(self, commands):
-        self.check_connection()
         if commands[0][0] != 'MULTI' or commands[-1][0] != 'EXEC':
             raise ValueError("Bulk must start with MULTI and end with EXEC")
-        buf = bytearray()
-        for cmd in commands:
-            encode_command(buf, cmd)
-        val = self._channel.request(buf, len(commands)).get()
+        if self._batches:
+            self._send_batches()
+        chan = self.check_connection()
+        buf = encode_commands(commands)
+        val = chan.request(buf, len(commands)).get()
         if val[0] != 'OK':
             raise RuntimeError(val, commands)
         for i in val[1:-1]:
@@ -219,4 +606,389 @@ class Redis(object):
                 raise i
             assert i == 'QUEUED'
         return val[-1]
+
+    def script(self, source):
+        return Script(self, source)
+
     # high-level stuff
+    def _scan(self, head, match, count, prefetch, tail=()):
+        if match is not None:
+            tail += ('MATCH', match)
+        if count is not None:
+            tail += ('COUNT', count)
+        return _Pages(self, head, tail, prefetch)
+
+    def scan(self, match=None, *, count=None, type=None, prefetch=2):
+        """Iterates over keys (as bytes), like ``KEYS`` but in pages
+
+        ``count`` is a hint of page size for the server. Up to ``prefetch``
+        pages (at least one) are fetched in background, while previous
+        ones are processed. Keys changed during iteration may be skipped
+        or returned twice, as documented for ``SCAN``.
+        """
+        tail = ('TYPE', type) if type is not None else ()
+        for page in self._scan(('SCAN',), match, count, prefetch, tail):
+            yield from map(bytes, page)
+
+    def sscan(self, key, match=None, *, count=None, prefetch=2):
+        """Iterates over members of a set, see ``scan()``"""
+        for page in self._scan(('SSCAN', key), match, count, prefetch):
+            yield from map(bytes, page)
+
+    def hscan(self, key, match=None, *, count=None, prefetch=2):
+        """Iterates over ``(field, value)`` pairs of a hash"""
+        for page in self._scan(('HSCAN', key), match, count, prefetch):
+            items = iter(page)
+            for field, value in zip(items, items):
+                yield bytes(field), bytes(value)
+
+    def zscan(self, key, match=None, *, count=None, prefetch=2):
+        """Iterates over ``(member, score)`` pairs of a sorted set"""
+        for page in self._scan(('ZSCAN', key), match, count, prefetch):
+            items = iter(page)
+            for member, score in zip(items, items):
+                yield bytes(member), float(score)
+
+
+class _Pages(object):
+    """Fetches pages of a ``SCAN``-like command ahead of the consumer"""
+
+    def __init__(self, redis, head, tail, prefetch):
+        if prefetch < 1:
+            raise ValueError("At least one page must be prefetched")
+        self.redis = redis
+        self.head = head  # arguments before cursor
+        self.tail = tail  # and after it
+        self.prefetch = prefetch
+        self.pages = deque()
+        self.error = None
+        self.done = False
+        self.stopped = False
+        # either consumer waits for a page, or fetcher for room, not both
+        self.cond = Condition()
+        gethub().do_spawn(self.fetch)
+
+    def fetch(self):
+        cursor = b'0'
+        try:
+            while not self.stopped:
+                if len(self.pages) >= self.prefetch:
+                    self.cond.wait()
+                    continue
+                reply = self.redis.execute(*(self.head + (cursor,)
+                                             + self.tail))
+                if isinstance(reply, RedisError):
+                    raise reply
+                cursor, items = reply
+                self.pages.append(items)
+                self.cond.notify()
+                if cursor == b'0':
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.cond.notify()
+
+    def __iter__(self):
+        try:
+            while True:
+                while not self.pages:
+                    if self.done:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    self.cond.wait()
+                page = self.pages.popleft()
+                self.cond.notify()
+                yield page
+        finally:
+            self.stopped = True
+            self.cond.notify()
+
+
+class Script(object):
+    """Lua script, which is sent to the server only when it's not cached
+
+    Script is run with ``EVALSHA``, and on ``NOSCRIPT`` error (e.g. after
+    server restart or ``SCRIPT FLUSH``) with ``EVAL``, which also caches
+    it again. Calling it returns reply of the script, errors are returned
+    as ``RedisError`` like for ``execute()``.
+    """
+
+    def __init__(self, redis, source):
+        self.redis = redis
+        self.source = convert[source.__class__](source)
+        self.sha = sha1(self.source).hexdigest()
+
+    def __call__(self, keys=(), args=()):
+        params = (len(keys),) + tuple(keys) + tuple(args)
+        res = self.redis.execute('EVALSHA', self.sha, *params)
+        if isinstance(res, RedisError) and str(res).startswith('NOSCRIPT'):
+            res = self.redis.execute('EVAL', self.source, *params)
+        return res
+
+
+class Cache(object):
+    """Local cache of ``GET`` replies, invalidated by keyspace notifications
+
+    Server must have keyspace events enabled, e.g. with
+    ``notify-keyspace-events Kg$xe``. Any event on a key drops it from the
+    cache. Until the server confirms the subscription (also after each
+    reconnect) nothing is cached and requests go to the server. The cache
+    is cleared when the connection is reestablished, because some
+    notifications could be lost.
+
+    Cache keeps at most ``size`` values, least recently used ones are
+    evicted first, and optionally ``ttl`` seconds each. Concurrent misses
+    of the same key share a single request. Values are returned as bytes.
+    """
+
+    def __init__(self, redis, *, size=10000, ttl=None, subscriber=None):
+        self.redis = redis
+        self.size = size
+        self.ttl = ttl
+        self.counters = dict(
+            hits=0,
+            misses=0,
+            coalesced=0,
+            evictions=0,
+            expirations=0,
+            invalidations=0,
+            )
+        self._values = OrderedDict()  # key -> (value, deadline)
+        self._pending = {}  # key -> [future, result may be cached]
+        self._prefix = '__keyspace@{:d}__:'.format(redis.db).encode('ascii')
+        if subscriber is None:
+            subscriber = Subscriber(redis.host, redis.port, redis.unixsock)
+        self._subscriber = subscriber
+        self._listening = None  # connection which notifications we get
+
+    def _coherent(self):
+        chan = self._subscriber._channel
+        if chan and chan is self._listening:
+            return True
+        self.clear()
+        sub = self._subscriber
+        pattern = self._prefix + b'*'
+        try:
+            if sub._patterns.get(pattern) != self._notified:
+                sub.psubscribe(self._notified, pattern)
+            elif not sub._reconnecting:
+                sub._connection()
+        except Exception as e:
+            log.warning("Can't subscribe to keyspace events: %r", e)
+        # changes made before subscription takes effect are not notified
+        chan = sub._channel
+        if chan and sub.subscribed(pattern, pattern=True):
+            self._listening = chan
+            return True
+        return False
+
+    def _notified(self, channel, event):
+        self.invalidate(channel[len(self._prefix):])
+
+    def get(self, key):
+        key = bytes(convert[key.__class__](key))
+        if not self._coherent():
+            self.counters['misses'] += 1
+            return self._fetch(key)
+        item = self._values.get(key)
+        if item is not None:
+            value, deadline = item
+            if deadline is None or deadline > gethub().now():
+                self._values.move_to_end(key)
+                self.counters['hits'] += 1
+                return value
+            del self._values[key]
+            self.counters['expirations'] += 1
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.counters['coalesced'] += 1
+            return _frozen(pending[0].get())
+        self.counters['misses'] += 1
+        pending = self._pending[key] = [self.redis.future('GET', key), True]
+        try:
+            value = _frozen(pending[0].get())
+        finally:
+            del self._pending[key]
+        if pending[1] and not isinstance(value, RedisError):
+            self._store(key, value)
+        return value
+
+    def _fetch(self, key):
+        return _frozen(self.redis.execute('GET', key))
+
+    def _store(self, key, value):
+        values = self._values
+        if self.ttl is not None:
+            values[key] = value, gethub().deadline(self.ttl)
+        else:
+            values[key] = value, None
+        values.move_to_end(key)
+        while len(values) > self.size:
+            values.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def invalidate(self, key):
+        key = bytes(convert[key.__class__](key))
+        if self._values.pop(key, None) is not None:
+            self.counters['invalidations'] += 1
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending[1] = False  # reply may be older than the change
+
+    def clear(self):
+        self._values.clear()
+        for pending in self._pending.values():
+            pending[1] = False
+
+
+def _frozen(value):
+    if value.__class__ is bytearray:
+        return bytes(value)
+    return value
+
+
+def _sum(results):
+    for res in results:
+        if isinstance(res, RedisError):
+            return res
+    return sum(results)
+
+
+def _all_ok(results):
+    for res in results:
+        if res != 'OK':
+            return res
+    return 'OK'
+
+
+class ShardedRedis(object):
+    """Redis client which distributes keys over several servers
+
+    Keys are mapped to servers with a consistent hash ring, compatible
+    with ketama (used by memcached clients), so adding or removing a server
+    moves only the keys of that server. Key must be the first argument of a
+    command. ``MGET``, ``MSET``, ``DEL``, ``EXISTS``, ``UNLINK`` and
+    ``TOUCH`` are split between servers, parts of a ``pipeline()`` are sent
+    to all servers in parallel.
+
+    Hosts are ``'host:port'`` strings, ``(host, port)`` tuples or
+    ``Redis`` instances.
+    """
+    POINTS = 160
+
+    def __init__(self, hosts, *, db=0, pool_size=1):
+        self.shards = []
+        ring = []
+        for host in hosts:
+            if isinstance(host, Redis):
+                shard = host
+            else:
+                if isinstance(host, str):
+                    host, _, port = host.partition(':')
+                    host = host, int(port or 6379)
+                shard = Redis(*host, db=db, pool_size=pool_size)
+            name = shard.unixsock or '{}:{}'.format(shard.host, shard.port)
+            if shard.db != db:
+                name += '/{}'.format(shard.db)
+            name = name.encode('utf-8')
+            idx = len(self.shards)
+            self.shards.append(shard)
+            for i in range(self.POINTS // 4):
+                digest = md5(name + b'-' + str(i).encode('ascii')).digest()
+                for j in range(0, 16, 4):
+                    point = int.from_bytes(digest[j:j+4], 'little')
+                    ring.append((point, idx))
+        ring.sort()
+        self._points = [p for p, i in ring]
+        self._indexes = [i for p, i in ring]
+
+    def shard_index(self, key):
+        key = convert[key.__class__](key)
+        point = int.from_bytes(md5(key).digest()[:4], 'little')
+        pos = bisect_left(self._points, point)
+        if pos == len(self._points):
+            pos = 0
+        return self._indexes[pos]
+
+    def shard(self, key):
+        """Returns ``Redis`` instance which holds the ``key``"""
+        return self.shards[self.shard_index(key)]
+
+    def _split(self, cmd):
+        """Returns parts of command as ``(shard index, command)`` pairs and
+        a function which makes the result of command from their results"""
+        if len(cmd) < 2:
+            raise ValueError("Can't find a key in {!r}".format(cmd))
+        name = cmd[0]
+        if isinstance(name, (bytes, bytearray)):
+            name = name.decode('ascii')
+        name = name.upper()
+        if name == 'MSET':
+            keys = cmd[1::2]
+            step = 2
+            combine = _all_ok
+        elif name in ('MGET', 'DEL', 'EXISTS', 'UNLINK', 'TOUCH'):
+            keys = cmd[1:]
+            step = 1
+            combine = _sum
+        else:
+            return [(self.shard_index(cmd[1]), cmd)], lambda res: res[0]
+        groups = {}
+        for n, key in enumerate(keys):
+            idx = self.shard_index(key)
+            if idx in groups:
+                grp = groups[idx]
+            else:
+                grp = groups[idx] = ([cmd[0]], [])
+            grp[0].extend(cmd[1+n*step:1+n*step+step])
+            grp[1].append(n)
+        if len(groups) == 1:
+            idx, = groups
+            return [(idx, cmd)], lambda res: res[0]
+        parts = [(idx, tuple(args)) for idx, (args, pos) in groups.items()]
+        if name == 'MGET':
+            positions = [pos for args, pos in groups.values()]
+            def combine(results):
+                value = [None]*len(keys)
+                for pos, res in zip(positions, results):
+                    if isinstance(res, RedisError):
+                        return res
+                    for n, val in zip(pos, res):
+                        value[n] = val
+                return value
+        return parts, combine
+
+    def execute(self, *args):
+        parts, combine = self._split(args)
+        if len(parts) == 1:
+            idx, cmd = parts[0]
+            return self.shards[idx].execute(*cmd)
+        futures = [self.shards[idx].future(*cmd) for idx, cmd in parts]
+        return combine([f.get() for f in futures])
+
+    def future(self, *args):
+        parts, combine = self._split(args)
+        if len(parts) == 1:
+            idx, cmd = parts[0]
+            return self.shards[idx].future(*cmd)
+        return Future(partial(self.execute, *args))
+
+    def pipeline(self, commands):
+        batches = {}
+        splits = []
+        for cmd in commands:
+            parts, combine = self._split(cmd)
+            refs = []
+            for idx, part in parts:
+                batch = batches.setdefault(idx, [])
+                refs.append((idx, len(batch)))
+                batch.append(part)
+            splits.append((refs, combine))
+        futures = {idx: Future(partial(self.shards[idx].pipeline, batch))
+                   for idx, batch in batches.items()}
+        results = {idx: fut.get() for idx, fut in futures.items()}
+        return [combine([results[idx][n] for idx, n in refs])
+                for refs, combine in splits]
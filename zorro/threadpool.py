@@ -0,0 +1,56 @@
+import threading
+from queue import Queue
+
+from .core import Future
+
+
+class ThreadPool(object):
+    """Runs blocking functions in threads, results are returned as Futures
+
+    Threads are started on demand, up to ``size`` of them. Results are
+    passed back with ``Hub.call_soon_threadsafe``, so any number of jobs
+    finished between two iterations of the hub loop cost a single wakeup.
+    """
+
+    def __init__(self, hub, size):
+        self.hub = hub
+        self.size = size
+        self._threads = []
+        self._idle = 0
+        self._jobs = Queue()
+        self._lock = threading.Lock()
+
+    def submit(self, fun, *args):
+        fut = Future()
+        self._jobs.put((fut, fun, args))
+        if len(self._threads) < self.size and \
+            self._jobs.qsize() > self._idle:
+            thread = threading.Thread(target=self._worker,
+                name='zorro-pool-{:d}'.format(len(self._threads)))
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+        return fut
+
+    def _worker(self):
+        lock = self._lock
+        while True:
+            with lock:
+                self._idle += 1
+            job = self._jobs.get()
+            with lock:
+                self._idle -= 1
+            if job is None:
+                return
+            fut, fun, args = job
+            try:
+                res = fut.set, fun(*args)
+            except Exception as e:
+                res = fut.throw, e
+            self.hub.call_soon_threadsafe(*res)
+            del job, fut, fun, args, res
+
+    def shutdown(self):
+        for i in self._threads:
+            self._jobs.put(None)
+        del self._threads[:]
@@ -1,32 +1,62 @@
 import fcntl
+import time
+from math import ceil
 from heapq import heappush, heappop
-from collections import deque
+from collections import OrderedDict
 
 
 class orderedset(object):
+    """FIFO queue with O(1) append, peek at the first item and removal
+
+    Items are kept in an OrderedDict under a unique key, so the remover
+    returned by ``add`` doesn't need to search for the value.
+    """
 
     def __init__(self):
-        self.deque = deque()
+        self.items = OrderedDict()
+        self.counter = 0
 
     def add(self, *val):
-        self.deque.append(val)
+        self.counter += 1
+        key = self.counter
+        self.items[key] = val
         def remover(*a):
-            self.deque.remove(val)
+            self.items.pop(key, None)
         return remover
 
+    def push(self, key, *val):
+        """Adds an item keyed by ``key``, removed with ``discard(key)``
+
+        This doesn't allocate a remover, but the ``key`` must not be in the
+        set already.
+        """
+        self.items[key] = (key,) + val
+
+    def discard(self, key):
+        self.items.pop(key, None)
+
     def update(self, value):
-        self.deque.extend(value)
+        for val in value:
+            self.counter += 1
+            self.items[self.counter] = val
 
     def first(self):
-        if self.deque:
-            return self.deque[0]
+        if self.items:
+            return next(iter(self.items.values()))
         return None
 
     def remove(self, value):
-        self.deque.remove(value)
+        for key, val in self.items.items():
+            if val == value:
+                del self.items[key]
+                return
+        raise ValueError(value)
+
+    def __len__(self):
+        return len(self.items)
 
     def __bool__(self):
-        return bool(self.deque)
+        return bool(self.items)
 
 
 class priorityqueue(object):
@@ -56,10 +86,177 @@ class priorityqueue(object):
             return self.heap[0][2]
         return None
 
+    def __len__(self):
+        return len(self.heap)
+
     def __bool__(self):
         return bool(self.heap)
 
 
+class timerwheel(object):
+    """Hierarchical timing wheel with the interface of priorityqueue
+
+    Deadlines are rounded up to ``tick`` seconds. Adding and cancelling
+    timers is O(1), and cancelled timers are dropped from the wheel
+    immediately instead of waiting in the heap until they expire.
+    """
+
+    def __init__(self, tick=0.001, *, bits=8, levels=4, now=time.monotonic):
+        self.tick = tick
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.wheels = [[{} for i in range(1 << bits)] for j in range(levels)]
+        self.counts = [0]*levels
+        self.expired = OrderedDict()
+        self.overflow = {}
+        self.current = int(now() / tick)
+        self.counter = 0
+
+    def _place(self, item):
+        tick = item[0]
+        delta = tick - self.current
+        if delta <= 0:
+            slot = self.expired
+            level = None
+        else:
+            level = (delta.bit_length() - 1) // self.bits
+            if level < self.levels:
+                slot = self.wheels[level][
+                    (tick >> (self.bits*level)) & self.mask]
+                self.counts[level] += 1
+            else:
+                slot = self.overflow
+                level = None
+        slot[item[1]] = item
+        item[3] = slot
+        item[4] = level
+
+    def add(self, pri, task):
+        self.counter += 1
+        item = [int(ceil(pri / self.tick)), self.counter, task, None, None]
+        self._place(item)
+        def remover(*a):
+            slot = item[3]
+            if slot is not None:
+                del slot[item[1]]
+                if item[4] is not None:
+                    self.counts[item[4]] -= 1
+                item[2] = item[3] = None
+        return remover
+
+    def _lowest_level(self):
+        for level, cnt in enumerate(self.counts):
+            if cnt:
+                return level
+        return None
+
+    def _cascade(self):
+        cur = self.current
+        bits = self.bits
+        for level in range(1, self.levels):
+            idx = (cur >> (bits*level)) & self.mask
+            slot = self.wheels[level][idx]
+            if slot:
+                self.counts[level] -= len(slot)
+                items = list(slot.values())
+                slot.clear()
+                for item in items:
+                    self._place(item)
+            if idx:
+                break
+        else:
+            if self.overflow:
+                items = list(self.overflow.values())
+                self.overflow.clear()
+                for item in items:
+                    self._place(item)
+
+    def _advance(self, target):
+        bits = self.bits
+        wheel = self.wheels[0]
+        while self.current < target:
+            level = self._lowest_level()
+            if level is None and not self.overflow:
+                self.current = target
+                break
+            if level != 0:
+                # nothing can expire before the next cascade, skip there
+                shift = bits*(level or self.levels)
+                boundary = ((self.current >> shift) + 1) << shift
+                if boundary > target:
+                    self.current = target
+                    break
+                self.current = boundary - 1
+            self.current += 1
+            if not self.current & self.mask:
+                self._cascade()
+            slot = wheel[self.current & self.mask]
+            if slot:
+                self.counts[0] -= len(slot)
+                for item in slot.values():
+                    item[3] = self.expired
+                    item[4] = None
+                self.expired.update(slot)
+                slot.clear()
+
+    def min(self):
+        if self.expired:
+            return self.current * self.tick
+        level = self._lowest_level()
+        if level is None:
+            if self.overflow:
+                level = self.levels
+            else:
+                return None
+        if level == 0:
+            cur = self.current
+            wheel = self.wheels[0]
+            mask = self.mask
+            for i in range(1, mask - (cur & mask) + 1):
+                if wheel[(cur + i) & mask]:
+                    return (cur + i) * self.tick
+            level = 1
+        shift = self.bits*level
+        return (((self.current >> shift) + 1) << shift) * self.tick
+
+    def pop(self, value):
+        self._advance(int(value / self.tick))
+        if self.expired:
+            return next(iter(self.expired.values()))[2]
+        return None
+
+    def __len__(self):
+        return sum(self.counts) + len(self.expired) + len(self.overflow)
+
+    def __bool__(self):
+        return bool(self.expired or self.overflow or any(self.counts))
+
+
+class histogram(object):
+    """Counts values in power of two buckets
+
+    Bucket ``i`` counts values less than ``unit * 2**i``, the last one
+    counts everything else.
+    """
+
+    def __init__(self, unit=1e-6, buckets=24):
+        self.unit = unit
+        self.counts = [0]*buckets
+
+    def add(self, value):
+        idx = int(value / self.unit).bit_length()
+        if idx >= len(self.counts):
+            idx = len(self.counts) - 1
+        self.counts[idx] += 1
+
+    def snapshot(self):
+        """Returns a dict of upper bound of bucket to nonzero count"""
+        last = len(self.counts) - 1
+        return {float('inf') if i == last else self.unit * (1 << i): cnt
+                for i, cnt in enumerate(self.counts) if cnt}
+
+
 try:
     from socket import socketpair
 except ImportError:
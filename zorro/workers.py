@@ -0,0 +1,204 @@
+"""Running a service on multiple cores
+
+Each worker is a forked process with it's own ``Hub``. Everything that is
+set up before the fork (configuration, imported modules, caches) is shared
+by workers, everything that needs a hub (zmq sockets, database
+connections) must be created in the worker function itself.
+
+Zeromq sockets should ``connect`` in each worker, so that the peer
+balances requests between workers. Plain TCP servers should use
+``listen_socket`` in each worker, which sets ``SO_REUSEPORT`` so kernel
+distributes incoming connections across workers. Unix sockets must be
+bound once before ``run``, so workers inherit the listening socket.
+
+Usage::
+
+    from zorro import zmq, workers
+
+    def worker():
+        sock = zmq.rep_socket(replier)
+        sock.connect('tcp://somewhere')
+
+    workers.run(worker, workers=4)
+
+Stopping the supervisor hub (either by ``Hub.stop()`` or by SIGTERM/SIGINT
+in ``workers.run``) stops all the workers gracefully.
+"""
+import os
+import errno
+import signal
+import socket
+import logging
+from functools import partial
+
+from greenlet import GreenletExit
+
+from .core import Hub, gethub
+from .util import setcloexec
+from . import sleep
+
+
+log = logging.getLogger(__name__)
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class Supervisor(object):
+    check_interval = 0.5
+
+    def __init__(self, target, *, workers=None, hub_options={},
+        restart=True, stop_timeout=10):
+        self.target = target
+        self.workers = workers or cpu_count()
+        self.hub_options = hub_options
+        self.restart = restart
+        self.stop_timeout = stop_timeout
+        self.children = {}  # pid -> worker index
+
+    def start(self):
+        """Forks workers and watches them in a service of current hub"""
+        return gethub().do_spawnservice(self._supervise)
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            log.info("Started worker %d with pid %d", index, pid)
+            self.children[pid] = index
+            return
+        code = 1
+        try:
+            self._worker(index)
+            code = 0
+        except BaseException:
+            log.exception("Worker %d crashed", index)
+        finally:
+            os._exit(code)
+
+    def _worker(self, index):
+        gethub().close_after_fork()
+        hub = Hub(**self.hub_options)
+        hub.worker_index = index
+        signal.signal(signal.SIGTERM, hub.handle_signal)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        hub.add_task(partial(self._watch_parent, os.getppid()))
+        hub.run(self.target)
+
+    def _watch_parent(self, ppid):
+        hub = gethub()
+        def watcher():
+            while True:
+                sleep(self.check_interval)
+                if os.getppid() != ppid:
+                    log.warning("Supervisor is dead, stopping worker")
+                    hub.handle_signal()
+                    return
+        hub.do_spawnhelper(watcher)
+
+    def _reap(self):
+        """Collects exited workers and returns their indexes"""
+        exited = []
+        for pid, index in list(self.children.items()):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                status = -1
+            else:
+                if not done:
+                    continue
+            del self.children[pid]
+            if status:
+                log.error("Worker %d (pid %d) died with status %d",
+                    index, pid, status)
+            else:
+                log.info("Worker %d (pid %d) exited", index, pid)
+            exited.append(index)
+        return exited
+
+    def _supervise(self):
+        for i in range(self.workers):
+            self._spawn(i)
+        try:
+            while True:
+                sleep(self.check_interval)
+                for index in self._reap():
+                    if self.restart:
+                        self._spawn(index)
+        except GreenletExit:
+            self.stop_workers()
+
+    def stop_workers(self):
+        """Sends SIGTERM to workers and waits until they exit
+
+        Workers which are not stopped in ``stop_timeout`` are killed
+        """
+        self._signal(signal.SIGTERM)
+        left = self.stop_timeout
+        while self.children and left > 0:
+            sleep(0.05)
+            left -= 0.05
+            self._reap()
+        if self.children:
+            log.warning("Killing %d workers", len(self.children))
+            self._signal(signal.SIGKILL)
+            while self.children:
+                sleep(0.05)
+                self._reap()
+
+    def _signal(self, sig):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+
+def run(target, *, workers=None, hub_options={}, **kwargs):
+    """Runs ``target`` in ``workers`` processes until SIGTERM or SIGINT"""
+    hub = Hub(**hub_options)
+    sup = Supervisor(target, workers=workers, hub_options=hub_options,
+        **kwargs)
+    signal.signal(signal.SIGTERM, hub.handle_signal)
+    signal.signal(signal.SIGINT, hub.handle_signal)
+    hub.run(sup.start)
+
+
+def listen_socket(addr, *, backlog=1024, reuse_port=True):
+    """Non-blocking listening TCP socket for use in each of the workers
+
+    Unix sockets can't be bound by several processes, so a path is
+    rejected. Bind it once before ``run()``, and the workers inherit it.
+    """
+    if isinstance(addr, str):
+        raise ValueError("Unix socket {!r} can't be bound in each worker"
+            .format(addr))
+    sock = socket.socket(socket.AF_INET6 if ':' in addr[0]
+        else socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    setcloexec(sock)
+    sock.setblocking(0)
+    sock.bind(addr)
+    sock.listen(backlog)
+    return sock
+
+
+def accept(sock):
+    """Waits for a connection on a listening socket"""
+    wait_read = gethub().do_read
+    while True:
+        try:
+            conn, addr = sock.accept()
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                wait_read(sock)
+                continue
+            raise
+        setcloexec(conn)
+        conn.setblocking(0)
+        return conn, addr